@@ -0,0 +1,165 @@
+import os
+import gzip
+import hashlib
+
+import lazyre
+
+# styles the first screen needs, inlined into the page head
+CRITICAL_CSS = ('main.css',)
+HASH_LENGTH = 10
+
+CSS_TOKEN_PAT = lazyre.compile(
+    r'(?P<ws>\s+)'
+    r'|(?P<com>/\*.*?\*/)'
+    r'|(?P<str>"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')'
+    r'|(?P<pun>[{};,>])'
+    r'|(?P<word>[^\s{};,>"\'/]+|/)', lazyre.S)
+CSS_PUNCTUATION = '{};,>'
+
+_brotli = None
+
+
+def _license(comment):
+    return comment.startswith('/*!') or '@license' in comment
+
+
+def minify_css(css):
+    r = []
+    space = False
+    for m in CSS_TOKEN_PAT.finditer(css):
+        kind = m.lastgroup
+        if kind == 'ws' or kind == 'com' and not _license(m.group()):
+            space = True
+            continue
+        token = m.group()
+        if token == '}' and r and r[-1] == ';':
+            r.pop()
+        elif (space and r and r[-1][-1] not in CSS_PUNCTUATION + ':'
+              and token[0] not in CSS_PUNCTUATION):
+            r.append(' ')
+        r.append(token)
+        space = False
+    return ''.join(r)
+
+
+def minify_js(js):
+    # drops indentation, blank lines and whole-line // comments; lines are
+    # kept, so semicolon insertion sees the same code. The vendored scripts
+    # ship minified and barely change
+    r = []
+    for line in js.split('\n'):
+        if r and r[-1].endswith('\\'):
+            r.append(line)
+            continue
+        line = line.strip()
+        if not line or line.startswith('//') and '*/' not in line:
+            continue
+        r.append(line)
+    return '\n'.join(r)
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def brotli():
+    # optional; without it only .gz siblings are written
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli as module
+        except ImportError:
+            module = False
+        _brotli = module
+    return _brotli
+
+
+def precompress(path, data=None):
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+    # a zero mtime keeps the archive identical for identical input
+    with open(path + '.gz', 'wb') as raw:
+        with gzip.GzipFile(os.path.basename(path), 'wb', 9, raw, 0) as f:
+            f.write(data)
+    if brotli():
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli().compress(data))
+
+
+def _version():
+    with open(os.path.splitext(__file__)[0] + '.py', 'rb') as f:
+        return f.read()
+
+
+def prune_hashed(directory, names):
+    # removes the hashed files, and their precompressed copies, not in names
+    current = set(names)
+    for name in os.listdir(directory):
+        hashed = name.rsplit('.', 1)[0] if name.endswith(
+            ('.gz', '.br')) else name
+        if hashed not in current:
+            os.remove(os.path.join(directory, name))
+
+
+class Links(object):
+    def __init__(self, url_prefix):
+        self.url_prefix = url_prefix
+
+    def url(self, name):
+        return '%s/%s' % (self.url_prefix, name)
+
+    def script(self, name):
+        return "<script src='%s'></script>" % self.url(name)
+
+    def stylesheet(self, name):
+        return "<link href='%s' rel='stylesheet'>" % self.url(name)
+
+
+class Assets(Links):
+    def __init__(self, source, directory, url_prefix):
+        Links.__init__(self, url_prefix)
+        self.source = source
+        self.directory = directory
+        self.names = {}
+        self.inline = {}
+
+    def _hashed_name(self, name, data):
+        base, ext = os.path.splitext(name)
+        h = hashlib.sha1(self.version)
+        h.update(data)
+        return '%s.%s%s' % (base, h.hexdigest()[:HASH_LENGTH], ext)
+
+    def build(self, suffixes, prune=True):
+        self.version = _version()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        written = 0
+        for name in sorted(os.listdir(self.source)):
+            ext = os.path.splitext(name)[1]
+            if ext not in suffixes:
+                continue
+            with open(os.path.join(self.source, name), 'rb') as f:
+                data = f.read()
+            if name in CRITICAL_CSS:
+                self.inline[name] = minify_css(data)
+                continue
+            hashed = self.names[name] = self._hashed_name(name, data)
+            path = os.path.join(self.directory, hashed)
+            # the name hashes the source, so an existing file is current
+            if os.path.exists(path + ('.br' if brotli() else '.gz')):
+                continue
+            data = MINIFIERS[ext](data)
+            with open(path, 'wb') as f:
+                f.write(data)
+            precompress(path, data)
+            written += 1
+        if prune:
+            prune_hashed(self.directory, self.names.values())
+        return written
+
+    def url(self, name):
+        return Links.url(self, self.names[name])
+
+    def stylesheet(self, name):
+        if name in self.inline:
+            return '<style>%s</style>' % self.inline[name]
+        return Links.stylesheet(self, name)
@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+from document import CodeBlock, SectionContext, Index
+from inline import InlineForge, ForgeCache
+from paragraph import Paragraph, Bullets, Table
+from instrument import _rss_kb
+import render
+
+BOOK_BYTES = 360 * 1024
+SECTION_BYTES = 8 * 1024
+SECTIONS_PER_CHAPTER = 10
+EXCERPT_CHARS = 300
+# a sample repeats its stage for at least this long, short stages are
+# otherwise timed below the timer's noise
+MIN_SECONDS = 0.2
+
+CJK = u''.join(unichr(c) for c in range(0x4e00, 0x4e00 + 400))
+IDENTIFIERS = ['std::move', 'unique_ptr', 'constexpr', 'noexcept', 'decltype',
+               'std::thread', 'operator()', 'nullptr', 'auto', 'T&&']
+CODE_LINES = ['#include <iostream>', 'int main()', '{', '}', 'return 0;',
+              '    std::cout << "hello" << std::endl;',
+              '    auto p = std::make_shared<int>(42);',
+              'template <typename T>', '    for (int i = 0; i < n; ++i) {',
+              '        v.push_back(std::move(x));', '    }']
+
+PATHOLOGICAL_LINES = [
+    u'**a' + u'\\*' * 200, u'^[[' * 200, u'` ' * 200 + u'`',
+    u'[img ' * 200, u'**`^[[\\' * 200, u'*' * 400,
+]
+
+
+def _words(rand, n):
+    r = []
+    for _ in range(n):
+        k = rand.random()
+        if k < 0.05:
+            r.append(u'`%s`' % rand.choice(IDENTIFIERS))
+        elif k < 0.08:
+            r.append(u'**%s**' % u''.join(rand.sample(CJK, 4)))
+        elif k < 0.09:
+            r.append(u'^[[%s]]' % u''.join(rand.sample(CJK, 12)))
+        else:
+            r.append(u''.join(rand.sample(CJK, rand.randint(2, 8))))
+    return u' '.join(r) + u'.'
+
+
+def _prose(rand):
+    return u'\n'.join(_words(rand, rand.randint(8, 30))
+                      for _ in range(rand.randint(1, 3)))
+
+
+def _bullets(rand):
+    mark = rand.choice([u'*', u'#'])
+    return u'\n'.join(u'%s %s' % (mark, _words(rand, 5))
+                      for _ in range(rand.randint(2, 6)))
+
+
+def _table(rand):
+    cols = rand.randint(2, 5)
+    row = lambda mark: mark + u' | '.join(
+        _words(rand, 2) for _ in range(cols))
+    lines = [u'|| ' + _words(rand, 3), row(u'|!')]
+    lines.extend(row(u'| ') for _ in range(rand.randint(2, 12)))
+    return u'\n'.join(lines)
+
+
+def _code(rand):
+    head = rand.choice([u'```', u'```+', u'```-', u'```!', u'``` cpp'])
+    body = [rand.choice(CODE_LINES) for _ in range(rand.randint(3, 30))]
+    return u'\n'.join([head] + body + [u'```'])
+
+
+def _ascii_art(rand):
+    lines = [u''.join(rand.choice(u' -|+.\'') for _ in range(40))
+             for _ in range(rand.randint(3, 10))]
+    if rand.random() < 0.5:
+        return u'\n'.join([u':::'] + lines + [u':::'])
+    return u'\n'.join(u': ' + ln for ln in lines)
+
+
+def _heading(rand):
+    return u'%s %s' % (u'=' * rand.randint(1, 3), _words(rand, 3))
+
+
+BLOCKS = [(_prose, 60), (_bullets, 8), (_table, 6), (_code, 14),
+          (_ascii_art, 4), (_heading, 8)]
+
+
+def _section(rand):
+    blocks = []
+    size = 0
+    while size < SECTION_BYTES:
+        k = rand.uniform(0, sum(w for _, w in BLOCKS))
+        for make, weight in BLOCKS:
+            k -= weight
+            if k <= 0:
+                break
+        blocks.append(make(rand))
+        size += len(blocks[-1].encode('utf-8'))
+    return u'\n\n'.join(blocks) + u'\n'
+
+
+def generate_corpus(directory, scale, seed=0):
+    rand = random.Random(seed)
+    sections = max(1, int(BOOK_BYTES * scale / SECTION_BYTES))
+    for i in range(sections):
+        chapter = os.path.join(directory, '%d.chapter' % (
+            i // SECTIONS_PER_CHAPTER + 1))
+        if i % SECTIONS_PER_CHAPTER == 0:
+            os.makedirs(chapter)
+            with open(os.path.join(chapter, '0.-.txt'), 'w') as f:
+                f.write(_prose(rand).encode('utf-8'))
+        name = '%d.section.txt' % (i % SECTIONS_PER_CHAPTER)
+        with open(os.path.join(chapter, name), 'w') as f:
+            f.write(_section(rand).encode('utf-8'))
+
+
+def load_corpus(directory):
+    return [render.read_doc(item[1]) for item in render.list_content(directory)
+            if item[0] == 'doc']
+
+
+def _utf8_len(texts):
+    return sum(len(t.encode('utf-8')) for t in texts)
+
+
+def _context():
+    return SectionContext(Index(1, 1))
+
+
+class Corpus(object):
+    def __init__(self, docs, large_path):
+        self.docs = docs
+        # every file in one document, as a multi-megabyte source
+        self.large = u'\n\n'.join(docs)
+        self.large_path = large_path
+        with open(large_path, 'wb') as f:
+            f.write(self.large.encode('utf-8'))
+        self.blocks = [p for doc in docs
+                       for p, _ in render.forge.partition(doc)]
+        self.prose = [ln[p.MARK:] for p in self.blocks
+                      if isinstance(p, (Paragraph, Bullets))
+                      for ln in p.lines]
+        self.tables = [p for p in self.blocks if isinstance(p, Table)]
+        self.code = [p for p in self.blocks if isinstance(p, CodeBlock)]
+
+    def stages(self):
+        forge = render.forge
+        para_forge = forge.para_forge
+        inline = para_forge.inline
+        doc_bytes = _utf8_len(self.docs)
+
+        def partition():
+            for doc in self.docs:
+                for _ in forge.partition(doc):
+                    pass
+
+        def partition_large():
+            for _ in forge.partition(self.large):
+                pass
+
+        def partition_mmap():
+            for _ in forge.partition(render.map_doc(self.large_path)):
+                pass
+
+        def find_paras():
+            for doc in self.docs:
+                for _ in para_forge.find_paras(doc):
+                    pass
+
+        def inline_forge():
+            ctx = _context()
+            for line in self.prose:
+                inline.forge(line, ctx)
+
+        def code_lines(cache=None):
+            # forged code repeats lines like '{' and 'return 0;'
+            forge = InlineForge(cache=cache)
+            ctx = _context()
+            for c in self.code:
+                for line in c.lines:
+                    forge.forge(line, ctx)
+
+        def code_lines_cached():
+            code_lines(ForgeCache(render.INLINE_CACHE_LINES))
+
+        def tables():
+            ctx = _context()
+            for t in self.tables:
+                t.build(ctx)
+
+        def code_blocks():
+            ctx = _context()
+            for c in self.code:
+                c.build(ctx)
+
+        def compile_fragments():
+            for doc in self.docs:
+                forge.compile_fragment(doc, Index(1, 1))
+
+        def hold_blocks():
+            # peak memory here is what a parsed corpus costs to keep
+            held = [list(forge.partition(doc)) for doc in self.docs]
+            return len(held)
+
+        def hold_rows():
+            ctx = _context()
+            held = [[t._forge_row(cells, ctx) for cells in t.rows]
+                    for t in self.tables]
+            return len(held)
+
+        def excerpts():
+            for doc in self.docs:
+                forge.compile_partial(doc, EXCERPT_CHARS, Index(1, 1))
+
+        def pathological():
+            ctx = _context()
+            for _ in range(len(self.docs)):
+                for line in PATHOLOGICAL_LINES:
+                    inline.forge(line, ctx)
+
+        return [
+            ('partition', partition, doc_bytes),
+            ('partition_large', partition_large, doc_bytes),
+            ('partition_mmap', partition_mmap, doc_bytes),
+            ('find_paras', find_paras, doc_bytes),
+            ('inline_forge', inline_forge, _utf8_len(self.prose)),
+            ('code_lines', code_lines, _utf8_len(
+                [ln for c in self.code for ln in c.lines])),
+            ('code_lines_cached', code_lines_cached, _utf8_len(
+                [ln for c in self.code for ln in c.lines])),
+            ('tables', tables, _utf8_len(
+                [c for t in self.tables for cells in t.rows for c in cells])),
+            ('code_blocks', code_blocks, _utf8_len(
+                [ln for c in self.code for ln in c.lines])),
+            ('compile', compile_fragments, doc_bytes),
+            ('excerpt', excerpts, doc_bytes),
+            ('hold_blocks', hold_blocks, doc_bytes),
+            ('hold_rows', hold_rows, _utf8_len(
+                [c for t in self.tables for cells in t.rows for c in cells])),
+            ('inline_pathological', pathological,
+             len(self.docs) * _utf8_len(PATHOLOGICAL_LINES)),
+        ]
+
+
+def _sample(stage):
+    # seconds per run, over as many runs as fill MIN_SECONDS
+    runs = 0
+    start = time.time()
+    while True:
+        stage()
+        runs += 1
+        elapsed = time.time() - start
+        if elapsed >= MIN_SECONDS:
+            return elapsed / runs
+
+
+def _measure(stage, repeat, conn):
+    # runs in a forked child, so ru_maxrss starts near the current rss
+    rss = _rss_kb()
+    samples = [_sample(stage) for _ in range(repeat)]
+    best = min(samples)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    conn.send((best, max(samples) / best - 1 if best else 0, max(peak, 0)))
+
+
+def measure(stage, repeat):
+    parent, child = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=_measure, args=(stage, repeat, child))
+    p.start()
+    r = parent.recv()
+    p.join()
+    return r
+
+
+def run(scales, repeat, seed):
+    # load templates up front so the first stage does not pay for them
+    render.environment().get_template('table.html')
+    # repeats would be served from the inline cache
+    render.forge.para_forge.inline.cache = None
+    results = {}
+    for scale in scales:
+        directory = tempfile.mkdtemp(prefix='cpp11book-bench-')
+        try:
+            content = os.path.join(directory, 'content')
+            generate_corpus(content, scale, seed)
+            corpus = Corpus(load_corpus(content),
+                            os.path.join(directory, 'large.txt'))
+            results[str(scale)] = r = {}
+            for name, stage, size in corpus.stages():
+                seconds, noise, peak_kb = measure(stage, repeat)
+                r[name] = {
+                    'bytes': size,
+                    'seconds': seconds,
+                    'noise': noise,
+                    'mb_per_s': size / 1048576.0 / seconds if seconds else 0,
+                    'peak_kb': peak_kb,
+                }
+        finally:
+            shutil.rmtree(directory)
+    return results
+
+
+def report(results, baseline, threshold, out):
+    regressions = []
+    for scale in sorted(results, key=float):
+        out.write('scale %sx\n' % scale)
+        for name, r in sorted(results[scale].items()):
+            line = '  %-20s %9.2f MB/s %9.3fs %5.1f%% noise %9d KB peak' % (
+                name, r['mb_per_s'], r['seconds'], r['noise'] * 100,
+                r['peak_kb'])
+            base = baseline.get(scale, {}).get(name)
+            if base and base['mb_per_s']:
+                change = r['mb_per_s'] / base['mb_per_s'] - 1
+                line += '  %+6.1f%%' % (change * 100)
+                # a loss within the spread of either run's samples is noise
+                if change < -max(threshold, r['noise'],
+                                 base.get('noise', 0)):
+                    line += '  REGRESSION'
+                    regressions.append((scale, name))
+            out.write(line + '\n')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark format stages on synthetic content trees')
+    parser.add_argument('--scale', type=float, nargs='+', default=[1, 10, 100],
+                        help='corpus sizes, as multiples of the book')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='samples per stage, the best is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default='bench-baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='throughput loss reported as a regression')
+    parser.add_argument('--generate', metavar='DIRECTORY',
+                        help='only write a corpus of the first scale')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.generate, args.scale[0], args.seed)
+        return
+
+    results = run(args.scale, args.repeat, args.seed)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.threshold, sys.stdout)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressions and not args.save_baseline:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
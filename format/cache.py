@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+
+from document import Fragment
+
+FORMAT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def _digest_files(h, directory, suffixes):
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1] not in suffixes:
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            h.update(name)
+            h.update(f.read())
+
+
+def fingerprint(template_directory, *options):
+    h = hashlib.sha1()
+    _digest_files(h, FORMAT_DIRECTORY, ('.py',))
+    _digest_files(h, template_directory, ('.html',))
+    for option in options:
+        h.update(option + '\0')
+    return h.hexdigest()
+
+
+class JsonStore(object):
+    SUFFIX = '.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _read(self, f):
+        return json.load(f)
+
+    def _write(self, value, f):
+        json.dump(value, f)
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return self._read(f)
+        except (IOError, ValueError, EOFError, TypeError):
+            return None
+
+    def store(self, key, value):
+        tmp = '%s.%d.tmp' % (self._path(key), os.getpid())
+        with open(tmp, 'wb') as f:
+            self._write(value, f)
+        os.rename(tmp, self._path(key))
+
+
+class BuildCache(JsonStore):
+    def __init__(self, directory, fingerprint):
+        JsonStore.__init__(self, directory)
+        self.fingerprint = fingerprint
+
+    def key(self, text, index):
+        h = hashlib.sha1(self.fingerprint)
+        h.update('%d.%d\n' % (index.chapter(), index.section()))
+        h.update(text.encode('utf-8'))
+        return h.hexdigest()
+
+    def load(self, key):
+        d = JsonStore.load(self, key)
+        if d is None:
+            return None
+        return Fragment(d['segs'], d['footnotes'])
+
+    def store(self, key, fragment):
+        JsonStore.store(self, key, {'segs': fragment.segs,
+                                    'footnotes': fragment.footnotes})
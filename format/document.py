@@ -1,26 +1,32 @@
-import re
-import cgi
-
 import tags
+import lazyre
 import paragraph
+import instrument
+from inline import escape
 
-SECTION_SPLIT_PAT = re.compile('\n\n+')
+SECTION_SPLIT_PAT = lazyre.compile('\n\n+')
+NON_SPACE_PAT = lazyre.compile(r'\S', lazyre.U)
 
-CODE_BLOCK_BEGIN_PAT = re.compile('^```[ ]*[-!+]?[ ]*\\w*\n', re.M)
+CODE_BLOCK_BEGIN_PAT = lazyre.compile('^```[ ]*[-!+]?[ ]*\\w*\n', lazyre.M)
 CODE_BLOCK_END_PAT = '\n```'
-CODE_LINE_SPACES_PAT = re.compile('(?P<s>([ ][ ]+))')
+CODE_LINE_SPACES_PAT = lazyre.compile('(?P<s>([ ][ ]+))')
+FOOTNOTE_ANCHOR_PAT = lazyre.compile(
+    "<sup class='fn-anchor' id='fn-anchor-(?P<index>\\d+)'>"
+    "<a href='#fn-\\d+'>\\d+</a></sup>")
 
 
 class CodeBlock(paragraph.Section):
-    def __init__(self, head, body, inline):
-        paragraph.Section.__init__(self, body.split('\n'), inline)
+    __slots__ = ('forged', 'no_number', 'require_number', 'lang',
+                 'highlighter', 'prettified')
+    FIELDS = ('lines', 'forged', 'no_number', 'require_number', 'lang')
+
+    def __init__(self, head, lines, inline, highlighter=None):
+        paragraph.Section.__init__(self, lines, inline)
         plus_pos = head.find('+')
         lang_start = -1
-        if plus_pos != -1:
-            self.inline_forge = self.inline.forge
+        self.forged = plus_pos != -1
+        if self.forged:
             lang_start = plus_pos
-        else:
-            self.inline_forge = lambda x, ctx: cgi.escape(x, quote=True)
 
         self.no_number = False
         self.require_number = False
@@ -37,6 +43,21 @@ class CodeBlock(paragraph.Section):
         else:
             self.lang = head[lang_start + 1:].strip() or 'cpp'
 
+        self.set_highlighter(highlighter)
+
+    def set_highlighter(self, highlighter):
+        # a highlighted page does not load prettify, so languages the
+        # highlighter does not support are left plain
+        self.highlighter = None
+        self.prettified = highlighter is None
+        if highlighter is not None and highlighter.supports(self.lang):
+            self.highlighter = highlighter
+
+    def inline_forge(self, line, ctx):
+        if self.forged:
+            return self.inline.forge(line, ctx)
+        return escape(line)
+
     def numbered(self):
         if self.no_number:
             return False
@@ -52,6 +73,12 @@ class CodeBlock(paragraph.Section):
                 chapter=idx.chapter(),
                 section=idx.section(),
                 index=idx.next_code_index())
+        if ctx.preformatted:
+            if not self.prettified:
+                return r + tags.CODE_BLOCK_BEGIN_HIGHLIGHTED_PRE % self.lang
+            return r + tags.CODE_BLOCK_BEGIN_PRE % self.lang
+        if not self.prettified:
+            return r + tags.CODE_BLOCK_BEGIN_HIGHLIGHTED % self.lang
         return r + tags.CODE_BLOCK_BEGIN % self.lang
 
     def tail(self):
@@ -60,14 +87,26 @@ class CodeBlock(paragraph.Section):
             t = '<hr>'
         return tags.CODE_BLOCK_END + t
 
+    def _html_lines(self, ctx):
+        if self.highlighter is None:
+            return [self.inline_forge(line, ctx) for line in self.lines]
+        if self.forged:
+            return [self.highlighter.html_line(
+                self.lang, self.inline_forge(line, ctx))
+                for line in self.lines]
+        return self.highlighter.lines(self.lang, '\n'.join(self.lines))
+
     def body(self, ctx):
+        if ctx.preformatted:
+            return '\n'.join(self._html_lines(ctx))
         return tags.BR.join([CODE_LINE_SPACES_PAT.sub(
-            lambda m: tags.SPACE * len(m.group('s')),
-            self.inline_forge(line, ctx)
-        ) for line in self.lines])
+            lambda m: tags.SPACE * len(m.group('s')), line
+        ) for line in self._html_lines(ctx)])
 
 
 class Index(object):
+    __slots__ = ('heading_indices', 'code_index')
+
     def __init__(self, index_1st, index_2nd):
         self.heading_indices = [index_1st, index_2nd, 0]
         self.code_index = 0
@@ -89,9 +128,66 @@ class Index(object):
         return r
 
 
+class Fragment(object):
+    __slots__ = ('segs', 'footnotes', 'terms')
+
+    def __init__(self, segs, footnotes):
+        self.segs = segs
+        self.footnotes = footnotes
+        # search terms, filled in by the build when it indexes
+        self.terms = None
+
+    def renumbered(self, base):
+        if base == 0 or not self.footnotes:
+            return self.segs
+        renumber = lambda m: tags.FOOTNOTE_ANCHOR.format(
+            index=int(m.group('index')) + base)
+        return [FOOTNOTE_ANCHOR_PAT.sub(renumber, s) for s in self.segs]
+
+    def prefixed(self, prefix, base=0):
+        # segs and footnotes with the footnote ids prefixed; numbers shown
+        # start at base instead of continuing those of the page
+        if not self.footnotes:
+            return self.segs, []
+        anchor = lambda m: tags.FOOTNOTE_ANCHOR_PREFIXED.format(
+            prefix=prefix, index=int(m.group('index')) + base)
+        return ([FOOTNOTE_ANCHOR_PAT.sub(anchor, s) for s in self.segs],
+                [tags.FOOTNOTE_PREFIXED.format(prefix=prefix, index=i,
+                                               content=p)
+                 for i, p in enumerate(self.footnotes, base)])
+
+
+class SectionContext(object):
+    __slots__ = ('index', 'footnotes', 'preformatted')
+
+    def __init__(self, index, preformatted=False):
+        self.index = index
+        self.footnotes = []
+        self.preformatted = preformatted
+
+    def current_index(self):
+        return self.index
+
+    def next_footnote_index(self, footnote):
+        r = len(self.footnotes)
+        self.footnotes.append(footnote)
+        return r
+
+
+def render_footnotes(footnotes):
+    return [tags.FOOTNOTE.format(index=i, content=p)
+            for i, p in enumerate(footnotes)]
+
+
 class DocumentForge(object):
-    def __init__(self, render_table, inline):
+    def __init__(self, render_table, inline, highlighter=None):
         self.para_forge = paragraph.ParaForge(render_table, inline)
+        self.highlighter = highlighter
+        # code and ascii art keep their whitespace instead of &nbsp; and <br>
+        self.preformatted = False
+        # a tree.ParseTreeStore, when parses are kept between builds
+        self.trees = None
+        self.problems = None
         self.secs = []
         self.footnotes = []
 
@@ -109,62 +205,104 @@ class DocumentForge(object):
     def current_index(self):
         return self.secs[-1]['index']
 
-    def _yield_paras(self, t):
-        text = t.lstrip()
-        if len(text) != 0:
-            stripped = len(t) - len(text)
-            start = 0
-            for match in SECTION_SPLIT_PAT.finditer(text):
-                for para, off in self.para_forge.find_paras(
-                        text[start: match.start()]):
-                    yield para, off + start + stripped
-                start = match.end()
-            for para, off in self.para_forge.find_paras(text[start:]):
-                yield para, off + start + stripped
-
-    def _consume_code_block(self, doc, cursor, head_start, head_end):
-        for p, off in self._yield_paras(doc[cursor: head_start]):
-            yield p, off + cursor
-        head = doc[head_start: head_end].strip()
+    def _yield_paras(self, doc, start, end):
+        m = NON_SPACE_PAT.search(doc, start, end)
+        if m is None:
+            return
+        start = m.start()
+        for match in SECTION_SPLIT_PAT.finditer(doc, start, end):
+            for para in self._find_paras(doc, start, match.start()):
+                yield para
+            start = match.end()
+        for para in self._find_paras(doc, start, end):
+            yield para
+
+    def _find_paras(self, doc, start, end):
+        return instrument.iterate('stage', 'find_paras',
+                                  self.para_forge.find_paras(doc, start, end),
+                                  end - start)
+
+    def _code_block(self, doc, head_start, head_end):
+        head = paragraph.text(doc, head_start, head_end).strip()
         body_end = doc.find(CODE_BLOCK_END_PAT, head_end)
         if -1 == body_end:
             body_end = len(doc)
-        yield (CodeBlock(head, doc[head_end: body_end],
-                         self.para_forge.inline),
-               body_end + len(CODE_BLOCK_END_PAT) + 1)
+            if self.problems is not None:
+                self.problems.append((head_start, 'unterminated ``` block'))
+        return (CodeBlock(head, paragraph.lines_of(doc, head_end, body_end),
+                          self.para_forge.inline, self.highlighter),
+                body_end + len(CODE_BLOCK_END_PAT) + 1)
                                         # +1 possible '\n' at the end of line
 
     def partition(self, doc):
+        # doc is unicode, or a utf-8 buffer from render.map_doc
         cursor = 0
-
         cb_match = CODE_BLOCK_BEGIN_PAT.search(doc)
         while cb_match is not None:
             head_start, head_end = cb_match.span()
-            para_end = 1
-            for para, para_end in self._consume_code_block(
-                    doc, cursor, head_start, head_end):
-                yield para, para_end
-            cursor = para_end
+            for para in self._yield_paras(doc, cursor, head_start):
+                yield para
+            block, cursor = self._code_block(doc, head_start, head_end)
+            yield block, cursor
             cb_match = CODE_BLOCK_BEGIN_PAT.search(doc, cursor)
 
-        for p, off in self._yield_paras(doc[cursor:]):
-            yield p, off + cursor
+        for para in self._yield_paras(doc, cursor, len(doc)):
+            yield para
+
+    def validate(self, doc):
+        # (offset, message) of every malformed block; blocks are detected
+        # but nothing is forged
+        problems = self.problems = self.para_forge.problems = []
+        try:
+            for _ in self.partition(doc):
+                pass
+        finally:
+            self.problems = self.para_forge.problems = None
+        return sorted(problems)
+
+    def parse(self, doc):
+        if self.trees is None:
+            return self.partition(doc)
+        return self.trees.parse(self, doc)
 
     def compile_entire(self, doc):
-        return [p.build(self) for p, _ in self.partition(doc)]
+        return [p.build(self) for p, _ in self.parse(doc)]
+
+    def compile_fragment(self, doc, index):
+        ctx = SectionContext(index, self.preformatted)
+        segs = []
+        start = 0
+        for p, end in instrument.iterate('stage', 'partition',
+                                         self.parse(doc), len(doc)):
+            with instrument.measure('block', type(p).__name__, end - start):
+                segs.append(p.build(ctx))
+            start = end
+        return Fragment(segs, ctx.footnotes)
+
+    def add_fragment(self, fragment):
+        segs = fragment.renumbered(len(self.footnotes))
+        self.footnotes.extend(fragment.footnotes)
+        return segs
 
     def render_footnotes(self):
-        return [tags.FOOTNOTE.format(index=i, content=p)
-                for i, p in enumerate(self.footnotes)]
-
-    def compile_partial(self, doc, limit):
-        def truncate(limit):
-            result = []
-            for para, _ in self.partition(doc):
-                limit = para.truncate_to(limit)
-                if limit < 0 and result:
-                    return result, False
-                result.append(para)
-            return result, True
-        paras, complete = truncate(limit)
-        return ''.join([p.build() for p in paras]), complete
+        return render_footnotes(self.footnotes)
+
+    def compile_partial(self, doc, limit, index):
+        # builds blocks until limit characters are used, cutting the last at
+        # a line or table row; partition is lazy, so the rest is not parsed
+        ctx = SectionContext(index, self.preformatted)
+        segs = []
+        complete = True
+        for para, _ in self.partition(doc):
+            if limit <= 0:
+                complete = False
+                break
+            limit = para.truncate_to(limit)
+            if limit is None:
+                complete = False
+                break
+            segs.append(para.build(ctx))
+            if limit < 0:
+                complete = False
+                break
+        return ''.join(segs + render_footnotes(ctx.footnotes)), complete
@@ -0,0 +1,117 @@
+import os
+import hashlib
+
+import lazyre
+from inline import escape
+
+# prettify class names, so prettify.css styles the output unchanged
+KEYWORD = 'kwd'
+TYPE = 'typ'
+LITERAL = 'lit'
+STRING = 'str'
+COMMENT = 'com'
+PUNCTUATION = 'pun'
+
+LANGUAGES = frozenset(['cpp', 'c', 'cc', 'cxx', 'c++', 'h', 'hpp'])
+
+CPP_KEYWORDS = frozenset('''
+alignas alignof asm auto bool break case catch char char16_t char32_t class
+const const_cast constexpr continue decltype default delete do double
+dynamic_cast else enum explicit export extern float for friend goto if
+inline int long mutable namespace new noexcept operator private protected
+public register reinterpret_cast return short signed sizeof static
+static_assert static_cast struct switch template this thread_local throw try
+typedef typeid typename union unsigned using virtual void volatile wchar_t
+while final override size_t
+'''.split())
+CPP_LITERALS = frozenset(['true', 'false', 'nullptr', 'NULL'])
+
+TOKEN_PAT = lazyre.compile(
+    r'(?P<com>//[^\n]*|/\*.*?(?:\*/|\Z)|^[ \t]*#[^\n]*)'
+    r'|(?P<raw>(?:u8|[uUL])?R"(?P<delim>[^ ()\\\t\n]{0,16})\(.*?'
+    r'(?:\)(?P=delim)"|\Z))'
+    r'|(?P<str>(?:u8|[uUL])?"(?:[^"\\\n]|\\.)*"?'
+    r"|(?:u8|[uUL])?'(?:[^'\\\n]|\\.)*'?)"
+    r'|(?P<lit>\.?\d[\w.]*)'
+    r'|(?P<id>[A-Za-z_]\w*)'
+    r'|(?P<pun>[^\w\s"\'/#]+|[/#])', lazyre.M | lazyre.S)
+TAG_PAT = lazyre.compile(r'(<[^>]*>)')
+
+UNESCAPES = (('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&amp;', '&'))
+
+
+def _identifier_class(word):
+    if word in CPP_KEYWORDS:
+        return KEYWORD
+    if word in CPP_LITERALS:
+        return LITERAL
+    if word[0].isupper() and not word.isupper() or word.endswith('_t'):
+        return TYPE
+    return None
+
+
+def lex(text):
+    pos = 0
+    for m in TOKEN_PAT.finditer(text):
+        if m.start() > pos:
+            yield None, text[pos: m.start()]
+        kind = m.lastgroup
+        if kind == 'id':
+            yield _identifier_class(m.group()), m.group()
+        elif kind in ('raw', 'delim'):
+            yield STRING, m.group()
+        else:
+            yield kind, m.group()
+        pos = m.end()
+    if pos < len(text):
+        yield None, text[pos:]
+
+
+def markup(text):
+    # spans are closed at line ends, so the result splits into lines
+    r = []
+    for cls, token in lex(text):
+        if cls is None:
+            r.append(escape(token))
+        else:
+            r.append('\n'.join(["<span class='%s'>%s</span>" % (
+                cls, escape(ln)) for ln in token.split('\n')]))
+    return ''.join(r)
+
+
+def _unescape(html):
+    for entity, char in UNESCAPES:
+        html = html.replace(entity, char)
+    return html
+
+
+class Highlighter(object):
+    def __init__(self, cache=None):
+        self.cache = cache
+        with open(os.path.splitext(__file__)[0] + '.py', 'rb') as f:
+            self.version = hashlib.sha1(f.read()).hexdigest()
+
+    def supports(self, lang):
+        return lang in LANGUAGES
+
+    def _key(self, lang, text):
+        h = hashlib.sha1(self.version)
+        h.update(lang + '\0')
+        h.update(text.encode('utf-8'))
+        return h.hexdigest()
+
+    def lines(self, lang, body):
+        if self.cache is None:
+            return markup(body).split('\n')
+        key = self._key(lang, body)
+        lines = self.cache.load(key)
+        if lines is None:
+            lines = markup(body).split('\n')
+            self.cache.store(key, lines)
+        return lines
+
+    def html_line(self, lang, html):
+        # highlights the text between the tags of inline forged html
+        return ''.join([
+            part if i % 2 else markup(_unescape(part))
+            for i, part in enumerate(TAG_PAT.split(html))])
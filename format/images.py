@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import struct
+import hashlib
+
+from cache import JsonStore
+from inline import IMG_RE, ESCAPE_RE
+
+# widths of the resized copies, each made only if smaller than the image
+VARIANT_WIDTHS = (480, 960)
+VARIANT_DIRECTORY = 'variants'
+JPEG_QUALITY = 80
+
+_pil = None
+
+
+def pil():
+    # optional; without it images keep their size but get no variants
+    global _pil
+    if _pil is None:
+        try:
+            from PIL import Image as module
+        except ImportError:
+            module = False
+        _pil = module
+    return _pil
+
+
+def references(texts):
+    names = set()
+    for text in texts:
+        for m in IMG_RE.finditer(text):
+            names.add(ESCAPE_RE.sub(lambda e: e.group('esc'), m.group('uri')))
+    return sorted(names)
+
+
+def _jpeg_size(data):
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != '\xff':
+            return None
+        marker = ord(data[i + 1])
+        if marker == 0xff:
+            i += 1
+            continue
+        length = struct.unpack('>H', data[i + 2: i + 4])[0]
+        # start of frame markers, less the huffman and arithmetic tables
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', data[i + 5: i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def intrinsic_size(data):
+    # (width, height) from the file header, None for unknown formats
+    if data[:8] == '\x89PNG\r\n\x1a\n' and data[12:16] == 'IHDR':
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in ('GIF87a', 'GIF89a'):
+        return struct.unpack('<HH', data[6:10])
+    if data[:2] == '\xff\xd8':
+        return _jpeg_size(data)
+    return None
+
+
+def _version():
+    with open(os.path.splitext(__file__)[0] + '.py', 'rb') as f:
+        return f.read()
+
+
+def _variants(path, directory, name, width):
+    image = pil().open(path)
+    base, ext = os.path.splitext(name)
+    r = []
+    for w in VARIANT_WIDTHS:
+        if w >= width:
+            break
+        variant = '%s.%dw%s' % (base, w, ext)
+        resized = image.resize(
+            (w, max(1, image.size[1] * w // width)), pil().ANTIALIAS)
+        out = os.path.join(directory, VARIANT_DIRECTORY, variant)
+        if not os.path.isdir(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        if ext.lower() in ('.jpg', '.jpeg'):
+            resized.save(out, quality=JPEG_QUALITY, optimize=True,
+                         progressive=True)
+        else:
+            resized.save(out, optimize=True)
+        r.append([(VARIANT_DIRECTORY + '/' + variant).decode('utf-8'), w])
+    return r
+
+
+def _process(job):
+    # runs in the pool; the cache is keyed by the source, so an unchanged
+    # image is only read and hashed
+    directory, cache_directory, name = job
+    path = os.path.join(directory, name.encode('utf-8'))
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return name, None
+    cache = None if cache_directory is None else JsonStore(cache_directory)
+    h = hashlib.sha1(_version())
+    h.update(repr((VARIANT_WIDTHS, bool(pil()))))
+    h.update(data)
+    key = h.hexdigest()
+    if cache is not None:
+        info = cache.load(key)
+        if info is not None and all(
+                os.path.exists(os.path.join(directory, v.encode('utf-8')))
+                for v, _ in info['variants']):
+            return name, info
+    size = intrinsic_size(data)
+    if size is None:
+        return name, None
+    info = {'width': size[0], 'height': size[1], 'variants': []}
+    if pil():
+        info['variants'] = _variants(path, directory, name.encode('utf-8'),
+                                     size[0])
+    if cache is not None:
+        cache.store(key, info)
+    return name, info
+
+
+def process(names, directory, cache_directory=None, pool=None):
+    # name -> {width, height, variants} of the images that could be read
+    jobs = [(directory, cache_directory, name) for name in names]
+    results = pool.map(_process, jobs) if pool is not None else map(
+        _process, jobs)
+    images = {}
+    for name, info in results:
+        if info is None:
+            sys.stderr.write('image not found or of unknown size: %s\n' %
+                             name.encode('utf-8'))
+            continue
+        images[name] = info
+    return images
+
+
+def digest(images):
+    return hashlib.sha1(json.dumps(images, sort_keys=True)).hexdigest()
@@ -1,53 +1,248 @@
 import re
-import cgi
+import time
 
 import tags
+import lazyre
+import instrument
 
-ESCAPE_RE = re.compile(r'\\(?P<esc>.)')
-BOLD_RE = re.compile(r'(?<!\\)\*\*(?! )(?P<bold>([^*]|\\[*])+)(?<![\\| ])\*\*')
-ITALIC_RE = re.compile(r'(?<!\\)/(?! )(?P<italic>([^/]|\\[/])+)(?<![\\| ])/'
-                       r'(?![\\a-zA-Z0-9:/])')
-STROKE_RE = re.compile(r'(?<!\\)~(?! )(?P<s>([^~]|\\[~])+)(?<![\\| ])~')
-MONOSPACE_RE = re.compile(r'(?<!\\)`(?! )(?P<ms>([^`]|\\[`])+)(?<![\\| ])`')
+ESCAPE_RE = lazyre.compile(r'\\(?P<esc>.)')
+ITALIC_GUARD_RE = lazyre.compile(r'[\\a-zA-Z0-9:/]')
 
-INLINE_EXPR_RE = re.compile(r'(?<!\\)\$(?P<expr>[^$]+)\$')
-ANCHOR_RE = re.compile(r'(?<!\\)#(?P<a>([^#]+))#')
-LINK_RE = re.compile(r'\[link (?P<uri>[^ \|\]]+)(?:\|(?P<text>[^\]]*))?]')
-PAGE_RE = re.compile(r'\[p (?P<uri>[^ \|\]]+)(?:\|(?P<text>[^\]]*))?]')
-IMG_RE = re.compile(r'\[img (?P<uri>[^ \|\]]+)]')
-USER_RE = re.compile(r'@(?P<username>[A-Za-z]\w*)(?!\.\w)')
+INLINE_EXPR_RE = lazyre.compile(r'(?<!\\)\$(?P<expr>[^$]+)\$')
+LINK_RE = lazyre.compile(r'\[link (?P<uri>[^ \|\]]+)(?:\|(?P<text>[^\]]*))?]')
+PAGE_RE = lazyre.compile(r'\[p (?P<uri>[^ \|\]]+)(?:\|(?P<text>[^\]]*))?]')
+IMG_RE = lazyre.compile(r'\[img (?P<uri>[^ \|\]]+)]')
+USER_RE = lazyre.compile(r'@(?P<username>[A-Za-z]\w*)(?!\.\w)')
 
-FOOTNOTE_RE = re.compile(r'\^\[\[(?P<fn>(.*))\]\]')
+FOOTNOTE_BEGIN = '^[['
+FOOTNOTE_END = ']]'
+
+# constructs not used by the book, which would clash with C++ in its text
+EXTENSIONS = {
+    'italic': ('/', '_italic'),
+    'stroke': ('~', '_stroke'),
+    'anchor': ('#', '_anchor'),
+    'link': ('[link ', '_link'),
+    'page': ('[p ', '_page'),
+    'user': ('@', '_user'),
+}
+
+
+def escape(text):
+    return (text.replace('&', tags.AND).replace('<', tags.LT)
+            .replace('>', tags.GT).replace('"', tags.QUOT))
+
+
+def _closer(text, delim, begin, end):
+    # first delim in [begin, end) not preceded by a back slash
+    i = text.find(delim, begin, end)
+    while i > 0 and text[i - 1] == '\\':
+        i = text.find(delim, i + 1, end)
+    return i
+
+
+def _span_end(text, i, end, delim):
+    # ends of **bold**, `monospace`, etc; content non-empty, not padded
+    begin = i + len(delim)
+    j = _closer(text, delim[0], begin, end)
+    if (j <= begin or text[begin] == ' ' or text[j - 1] in '| ' or
+            j + len(delim) > end or text[j: j + len(delim)] != delim):
+        return -1
+    return j
+
+
+class ForgeCache(object):
+    # forged html by line text; a line with a footnote is never kept, its
+    # anchor takes the next index of the context. Cleared when full
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def forge(self, inline, text, ctx):
+        try:
+            html, seconds = self.entries[text]
+        except KeyError:
+            start = time.time()
+            html = inline._forge(text, 0, len(text), ctx, True)
+            self.misses += 1
+            if len(self.entries) >= self.capacity:
+                self.entries.clear()
+            self.entries[text] = html, time.time() - start
+            return html
+        self.hits += 1
+        self.seconds_saved += seconds
+        return html
+
+    def clear(self):
+        self.entries.clear()
+
+    def report(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'seconds_saved': self.seconds_saved}
 
 
 class InlineForge(object):
-    def __init__(self):
-        pass
+    def __init__(self, extensions=(), cache=None):
+        self.cache = cache
+        # (text, start, position) of the last search for a ']'
+        self._close = None
+        # name -> size and variants, see images.py; None leaves [img] bare
+        self.images = None
+        self.handlers = {
+            '\\': self._escape,
+            '**': self._bold,
+            '`': self._monospace,
+            FOOTNOTE_BEGIN: self._footnote,
+            '[img ': self._image,
+        }
+        for name in extensions:
+            if name not in EXTENSIONS:
+                raise ValueError('unknown inline extension: ' + name)
+            token, handler = EXTENSIONS[name]
+            self.handlers[token] = getattr(self, handler)
+        self.token_re = lazyre.compile('|'.join([
+            re.escape(t) for t in sorted(self.handlers, key=len,
+                                         reverse=True)]))
+
+    def _forge(self, text, begin, end, ctx, footnotes):
+        # one left to right pass; each handler either consumes a construct
+        # and returns (html, position after it), or returns None and the
+        # token's first char is kept as plain text
+        fn_end = text.rfind(FOOTNOTE_END, begin, end) if footnotes else -1
+        r = []
+        plain = begin
+        cursor = begin
+        while True:
+            m = self.token_re.search(text, cursor, end)
+            if m is None:
+                break
+            i = m.start()
+            result = self.handlers[m.group()](text, i, end, ctx, fn_end)
+            if result is None:
+                cursor = i + 1
+                continue
+            r.append(escape(text[plain: i]))
+            r.append(result[0])
+            plain = cursor = result[1]
+        r.append(escape(text[plain: end]))
+        return ''.join(r)
+
+    def _nested(self, text, begin, end, ctx, fn_end):
+        return self._forge(text, begin, end, ctx, fn_end != -1)
+
+    def _escape(self, text, i, end, ctx, fn_end):
+        if i + 1 == end:
+            return None
+        return escape(text[i + 1]), i + 2
+
+    def _delimited(self, tag, delim, text, i, end, ctx, fn_end):
+        j = _span_end(text, i, end, delim)
+        if j == -1:
+            return None
+        return (tag % self._nested(text, i + len(delim), j, ctx, fn_end),
+                j + len(delim))
+
+    def _bold(self, text, i, end, ctx, fn_end):
+        return self._delimited(tags.BOLD, '**', text, i, end, ctx, fn_end)
+
+    def _monospace(self, text, i, end, ctx, fn_end):
+        return self._delimited(tags.MONOSPACE, '`', text, i, end, ctx, fn_end)
+
+    def _stroke(self, text, i, end, ctx, fn_end):
+        return self._delimited(tags.STROKE, '~', text, i, end, ctx, fn_end)
+
+    def _italic(self, text, i, end, ctx, fn_end):
+        j = _span_end(text, i, end, '/')
+        if j == -1 or ITALIC_GUARD_RE.match(text, j + 1):
+            return None
+        return tags.ITALIC % self._nested(text, i + 1, j, ctx, fn_end), j + 1
+
+    def _footnote(self, text, i, end, ctx, fn_end):
+        begin = i + len(FOOTNOTE_BEGIN)
+        if fn_end < begin:
+            return None
+        content = self._forge(text, begin, fn_end, ctx, False)
+        return (tags.FOOTNOTE_ANCHOR.format(
+                    index=ctx.next_footnote_index(content)),
+                fn_end + len(FOOTNOTE_END))
+
+    def _image(self, text, i, end, ctx, fn_end):
+        m = IMG_RE.match(text, i, end)
+        if m is None:
+            return None
+        uri = ESCAPE_RE.sub(lambda m: m.group('esc'), m.group('uri'))
+        info = self.images.get(uri) if self.images else None
+        if info is None:
+            return tags.IMAGE % escape(uri), m.end()
+        return self._sized_image(uri, info), m.end()
 
-    def convert_html_tags(self, text, ctx):
-        def esc_back_slash(text):
-            return ESCAPE_RE.sub(lambda m: m.group('esc'), text)
+    def _sized_image(self, uri, info):
+        srcset = ''
+        if info['variants']:
+            srcset = tags.IMAGE_SRCSET.format(
+                candidates=', '.join([
+                    tags.IMAGE_CANDIDATE.format(uri=escape(v), width=w)
+                    for v, w in info['variants'] + [[uri, info['width']]]]),
+                width=info['width'])
+        return tags.IMAGE_SIZED.format(
+            uri=escape(uri), width=info['width'], height=info['height'],
+            srcset=srcset)
 
-        def bold(text):
-            return BOLD_RE.sub(lambda m: tags.BOLD % m.group('bold'), text)
+    def _anchor(self, text, i, end, ctx, fn_end):
+        j = text.find('#', i + 1, end)
+        if j <= i + 1:
+            return None
+        return (tags.ANCHOR % (escape(text[i + 1: j]),
+                               self._nested(text, i + 1, j, ctx, fn_end)),
+                j + 1)
 
-        def italic(text):
-            return ITALIC_RE.sub(lambda m: tags.ITALIC % m.group('italic'),
-                                 text)
+    def _bracket_close(self, text, i, end):
+        # first ']' in [i, end); the last search, made to the end of the
+        # text so nested ranges share it, is reused, so a line of unclosed
+        # openers is scanned once rather than once per opener
+        memo = self._close
+        if (memo is not None and memo[0] is text and memo[1] <= i and
+                (memo[2] == -1 or memo[2] >= i)):
+            close = memo[2]
+        else:
+            close = text.find(']', i)
+            self._close = text, i, close
+        return close if close < end else -1
 
-        def monospace(text):
-            return MONOSPACE_RE.sub(lambda m: tags.MONOSPACE % m.group('ms'),
-                                    text)
+    def _hyperlink(self, tag, pattern, text, i, end, ctx, fn_end):
+        # the pattern cannot match past the first ']'
+        close = self._bracket_close(text, i, end)
+        if close == -1:
+            return None
+        m = pattern.match(text, i, close + 1)
+        if m is None:
+            return None
+        if m.group('text'):
+            content = self._nested(text, m.start('text'), m.end('text'), ctx,
+                                   fn_end)
+        else:
+            content = escape(m.group('uri'))
+        return tag % (escape(m.group('uri')), content), m.end()
 
-        def image(text):
-            return IMG_RE.sub(lambda m: tags.IMAGE % m.group('uri'), text)
+    def _link(self, text, i, end, ctx, fn_end):
+        return self._hyperlink(tags.LINK, LINK_RE, text, i, end, ctx, fn_end)
 
-        def footnote(text, ctx):
-            return FOOTNOTE_RE.sub(lambda m: tags.FOOTNOTE_ANCHOR.format(
-                index=ctx.next_footnote_index(m.group('fn'))), text)
+    def _page(self, text, i, end, ctx, fn_end):
+        return self._hyperlink(tags.PAGE, PAGE_RE, text, i, end, ctx, fn_end)
 
-        return esc_back_slash(image(footnote(
-            monospace(bold(cgi.escape(text, quote=True))), ctx)))
+    def _user(self, text, i, end, ctx, fn_end):
+        m = USER_RE.match(text, i, end)
+        if m is None:
+            return None
+        return tags.USER % (m.group('username'), m.group('username')), m.end()
 
     def forge(self, text, ctx):
-        return ''.join(self.convert_html_tags(text, ctx))
+        with instrument.measure('stage', 'inline_forge', len(text)):
+            if self.cache is None or FOOTNOTE_BEGIN in text:
+                return self._forge(text, 0, len(text), ctx, True)
+            return self.cache.forge(self, text, ctx)
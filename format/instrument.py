@@ -0,0 +1,118 @@
+import os
+import time
+
+_recorder = None
+
+
+def _rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except IOError:
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+class Stat(object):
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.input = 0
+        # None unless measured with rss
+        self.rss_kb = None
+
+    def as_dict(self):
+        r = {'calls': self.calls, 'seconds': self.seconds,
+             'input': self.input}
+        if self.rss_kb is not None:
+            r['rss_kb'] = self.rss_kb
+        return r
+
+
+class _Null(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _Null()
+
+
+class _Timer(object):
+    def __init__(self, stat, size, rss):
+        self.stat = stat
+        self.size = size
+        self.rss = rss
+
+    def __enter__(self):
+        if self.rss:
+            self.rss_start = _rss_kb()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.stat.seconds += time.time() - self.start
+        if self.rss:
+            self.stat.rss_kb = (self.stat.rss_kb or 0) + (
+                _rss_kb() - self.rss_start)
+        self.stat.calls += 1
+        self.stat.input += self.size
+        return False
+
+
+class Recorder(object):
+    def __init__(self):
+        self.stats = {}
+
+    def stat(self, kind, name):
+        try:
+            return self.stats[(kind, name)]
+        except KeyError:
+            s = self.stats[(kind, name)] = Stat()
+            return s
+
+    def report(self):
+        r = {}
+        for (kind, name), s in self.stats.items():
+            r.setdefault(kind, {})[name] = s.as_dict()
+        return r
+
+    def top(self, n):
+        return sorted(self.stats.items(), key=lambda x: -x[1].seconds)[:n]
+
+
+def enable():
+    global _recorder
+    _recorder = Recorder()
+    return _recorder
+
+
+def measure(kind, name, size=0, rss=False):
+    # time and input size of a with-block, and its rss growth if asked;
+    # reading rss costs a file read, so only whole build stages ask for it.
+    # no-op unless enabled
+    if _recorder is None:
+        return _NULL
+    return _Timer(_recorder.stat(kind, name), size, rss)
+
+
+def _iterate(stat, iterable, size):
+    stat.calls += 1
+    stat.input += size
+    it = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            item = next(it)
+        finally:
+            stat.seconds += time.time() - start
+        yield item
+
+
+def iterate(kind, name, iterable, size=0):
+    # charges the time spent producing each item of a generator, and size
+    # as its input
+    if _recorder is None:
+        return iterable
+    return _iterate(_recorder.stat(kind, name), iterable, size)
@@ -0,0 +1,35 @@
+import re
+
+M = re.M
+S = re.S
+U = re.U
+
+
+class LazyPattern(object):
+    def __init__(self, pattern, flags):
+        self.pattern = pattern
+        self.flags = flags
+        self._compiled = None
+
+    def __getattr__(self, name):
+        if self._compiled is None:
+            self._compiled = re.compile(self.pattern, self.flags)
+        attr = getattr(self._compiled, name)
+        # bound methods go into the instance, so later lookups skip here
+        setattr(self, name, attr)
+        return attr
+
+
+_patterns = []
+
+
+def compile(pattern, flags=0):
+    p = LazyPattern(pattern, flags)
+    _patterns.append(p)
+    return p
+
+
+def compile_all():
+    # before forking, so children share compiled patterns
+    for p in _patterns:
+        p.match
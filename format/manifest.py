@@ -0,0 +1,54 @@
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = 'manifest.json'
+HASH_LENGTH = 10
+
+
+class FragmentWriter(object):
+    # writes html fragments under content hashed names, so a file that
+    # exists already is unchanged and a deploy only syncs new names
+    def __init__(self, directory, compress=None):
+        self.directory = directory
+        self.compress = compress
+        self.entries = []
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.previous = {}
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE)) as f:
+                for entry in json.load(f)['fragments']:
+                    self.previous[entry['id']] = entry['sha1']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def write(self, fragment_id, html):
+        data = html.encode('utf-8')
+        sha1 = hashlib.sha1(data).hexdigest()
+        name = '%s.%s.html' % (fragment_id, sha1[:HASH_LENGTH])
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path if self.compress is None else
+                              path + '.gz'):
+            with open(path, 'wb') as f:
+                f.write(data)
+            if self.compress is not None:
+                self.compress(path, data)
+        self.entries.append({'id': fragment_id, 'file': name, 'sha1': sha1,
+                             'bytes': len(data)})
+
+    def changed(self):
+        return [e['id'] for e in self.entries
+                if self.previous.get(e['id']) != e['sha1']]
+
+    def finish(self):
+        with open(os.path.join(self.directory, MANIFEST_FILE), 'w') as f:
+            json.dump({'fragments': self.entries}, f, indent=1,
+                      sort_keys=True, separators=(',', ': '))
+        current = set([e['file'] for e in self.entries] + [MANIFEST_FILE])
+        for name in os.listdir(self.directory):
+            base = name.rsplit('.', 1)[0] if name.endswith(
+                ('.gz', '.br')) else name
+            path = os.path.join(self.directory, name)
+            if base not in current and os.path.isfile(path):
+                os.remove(path)
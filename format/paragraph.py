@@ -1,9 +1,33 @@
-import re
-import cgi
 import bisect
 
 import tags
-from inline import LINK_RE, PAGE_RE, INLINE_EXPR_RE
+import lazyre
+import instrument
+from inline import LINK_RE, PAGE_RE, INLINE_EXPR_RE, escape
+
+
+def line_end(doc, pos, end):
+    nl = doc.find('\n', pos, end)
+    return end if nl == -1 else nl
+
+
+def text(doc, start, end):
+    s = doc[start: end]
+    return s if isinstance(s, unicode) else s.decode('utf-8')
+
+
+def lines_of(doc, start, end):
+    return text(doc, start, end).split('\n')
+
+
+def truncate_lines(lines, limit, mark=0):
+    # keeps lines while budget is left, the line crossing it included;
+    # the budget left is negative only if lines were dropped
+    for i, ln in enumerate(lines):
+        if limit <= 0:
+            return lines[:i], -1
+        limit -= max(len(ln) - mark, 0)
+    return lines, max(limit, 0)
 
 
 def forge_line(modifiers, line):
@@ -13,6 +37,11 @@ def forge_line(modifiers, line):
 
 
 class Block(object):
+    # blocks are slotted, a parsed corpus holds many of them
+    __slots__ = ('inline',)
+    # the attributes a parse tree keeps, see tree.py
+    FIELDS = ()
+
     def __init__(self, inline):
         self.inline = inline
 
@@ -20,10 +49,18 @@ class Block(object):
         return ''
 
     def truncate_to(self, limit):
-        return 0
+        # the budget left, negative if the block was cut, None if not even
+        # its first line fits
+        return limit
 
 
 class Section(Block):
+    __slots__ = ('lines',)
+    FIELDS = ('lines',)
+    # width of the mark starting each line; lines are kept as parsed and
+    # the mark is cut off as they are built
+    MARK = 0
+
     def __init__(self, lines, inline):
         Block.__init__(self, inline)
         self.lines = lines
@@ -41,19 +78,17 @@ class Section(Block):
         return ''
 
     def truncate_to(self, limit):
-        i = 0
-        for i, ln in enumerate(self.lines):
-            limit -= len(ln)
-            if limit <= 0:
-                self.lines = self.lines[:i + 1]
-                return limit
+        self.lines, limit = truncate_lines(self.lines, limit, self.MARK)
         return limit
 
 
 class Paragraph(Section):
+    __slots__ = ()
+
     @staticmethod
     def make(lines, inline):
-        lines = filter(None, lines)
+        if not all(lines):
+            lines = filter(None, lines)
         if len(lines) == 0:
             return None
         return Paragraph(lines, inline)
@@ -76,13 +111,20 @@ class Paragraph(Section):
 
 
 class Bullets(Section):
+    __slots__ = ()
+    MARK = 2
+
     def __init__(self, lines, inline):
-        Section.__init__(self, filter(None, [ln[2:] for ln in lines]), inline)
+        if not all([len(ln) > 2 for ln in lines]):
+            lines = [ln for ln in lines if len(ln) > 2]
+        Section.__init__(self, lines, inline)
 
     def body(self, ctx):
-        return ''.join(sum([
-            [tags.LI_BEGIN, self.inline.forge(line, ctx), tags.LI_END]
-            for line in self.lines], []))
+        r = []
+        for line in self.lines:
+            r.extend([tags.LI_BEGIN, self.inline.forge(line[self.MARK:], ctx),
+                      tags.LI_END])
+        return ''.join(r)
 
     def head(self, ctx):
         return tags.UL_BEGIN
@@ -92,6 +134,8 @@ class Bullets(Section):
 
 
 class SortedList(Bullets):
+    __slots__ = ()
+
     def __init__(self, lines, inline):
         Bullets.__init__(self, lines, inline)
 
@@ -103,94 +147,98 @@ class SortedList(Bullets):
 
 
 class Table(Block):
-    CELL_SPLIT = re.compile(r'(?<![\\])[\|]')
+    CELL_SPLIT = lazyre.compile(r'(?<![\\])[\|]')
+    # rows are split into cell sources once, on parsing, and kept in the
+    # parse tree; cells are forged as the template streams the body rows
+    __slots__ = ('rows', 'head', 'render_table', 'caption')
+    FIELDS = ('rows', 'head', 'caption')
 
     class Cell(object):
+        __slots__ = ('content',)
+
         def __init__(self, content):
             self.content = content
 
     class Row(list):
+        __slots__ = ()
+
         def __init__(self):
             list.__init__(self, [])
 
     def __init__(self, lines, render_table, inline):
         Block.__init__(self, inline)
-        self.lines = lines
         self.render_table = render_table
         self.caption = ''
-
-    def build(self, ctx):
-        head_rows, body_rows = self._parse_rows(self.lines, ctx)
-        return self.render_table(self.caption, head_rows, body_rows)
-
-    def _parse_rows(self, lines, ctx):
-        head_rows = []
+        self.head = 0
         for line in lines:
             if line[:2] != '|!':
                 break
-            head_rows.append(self._parse_row(line[2:], ctx))
-        return head_rows, [self._parse_row(line[1:], ctx)
-                           for line in lines[len(head_rows):]]
-
-    def _parse_row(self, line, ctx):
-        spans = sorted(
-            [m.span() for m in LINK_RE.finditer(line)] +
-            [m.span() for m in PAGE_RE.finditer(line)] +
-            [m.span() for m in INLINE_EXPR_RE.finditer(line)])
+            self.head += 1
+        self.rows = [self._split_row(line[2:]) for line in lines[:self.head]]
+        self.rows.extend([self._split_row(line[1:])
+                          for line in lines[self.head:]])
+
+    def build(self, ctx):
+        head_rows = [self._forge_row(cells, ctx)
+                     for cells in self.rows[:self.head]]
+        body_rows = (self._forge_row(cells, ctx)
+                     for cells in self.rows[self.head:])
+        return self.render_table(self.caption, head_rows, body_rows,
+                                 len(self.rows) - self.head)
+
+    def _forge_row(self, cells, ctx):
         row = Table.Row()
+        row.extend([Table.Cell(self.inline.forge(c, ctx)) for c in cells])
+        return row
+
+    def _split_row(self, line):
+        with instrument.measure('stage', 'table_split_row', len(line)):
+            return self._split_cells(line)
+
+    def _split_cells(self, line):
+        # a | inside a link, page or inline expression does not split
+        spans = []
+        if '[' in line or '$' in line:
+            spans = sorted(
+                [m.span() for m in LINK_RE.finditer(line)] +
+                [m.span() for m in PAGE_RE.finditer(line)] +
+                [m.span() for m in INLINE_EXPR_RE.finditer(line)])
+        cells = []
         begin = 0
         for c in Table.CELL_SPLIT.finditer(line):
             c_span = c.span()
             span_i = bisect.bisect_left(spans, c_span)
-            if span_i == 0:
-                row.append(Table.Cell(self.inline.forge(
-                    line[begin: c_span[0]].strip(), ctx)))
-                begin = c_span[1]
-                continue
-            span = spans[span_i - 1]
-            if span[1] < c_span[1]:
-                row.append(Table.Cell(self.inline.forge(
-                    line[begin: c_span[0]].strip(), ctx)))
+            if span_i == 0 or spans[span_i - 1][1] < c_span[1]:
+                cells.append(line[begin: c_span[0]].strip())
                 begin = c_span[1]
-        row.append(Table.Cell(self.inline.forge(line[begin:].strip(), ctx)))
-        return row
-
-    @staticmethod
-    def _truncate_at(rows, limit):
-        for i, row in enumerate(rows):
-            for c in row:
-                limit -= len(c.content)
-            if limit <= 0:
-                return rows[:i + 1], limit
-        return rows, limit
+        cells.append(line[begin:].strip())
+        return cells
 
     def truncate_to(self, limit):
-        head_rows, body_rows = self._parse_rows(self.lines, None)
+        # cuts at a row, measured by its cell sources; nothing is forged
         limit -= len(self.caption)
-        if limit <= 0:
-            self.caption = ''
-            del head_rows[:]
-            del body_rows[:]
-            return limit
-
-        rows, limit = Table._truncate_at(head_rows, limit)
-        if limit <= 0:
-            head_rows = rows
-            del self.body_rows[:]
-            return limit
-
-        rows, limit = Table._truncate_at(self.body_rows, limit)
-        self.body_rows = rows
-        return limit
+        if limit <= 0 and self.rows:
+            return None
+        for i, cells in enumerate(self.rows):
+            if limit <= 0:
+                self.rows = self.rows[:i]
+                self.head = min(self.head, i)
+                return -1
+            limit -= sum([len(c) for c in cells])
+        return max(limit, 0)
 
 
 class TableWithCaption(Table):
+    __slots__ = ()
+
     def __init__(self, lines, render_table, inline):
         Table.__init__(self, lines[1:], render_table, inline)
         self.caption = lines[0][2:].strip()
 
 
 class AsciiArtBase(Section):
+    __slots__ = ()
+
     def __init__(self, lines, inline):
         Section.__init__(self, lines, inline)
 
@@ -201,26 +249,38 @@ class AsciiArtBase(Section):
         return tags.AA_END
 
     def body(self, ctx):
+        if ctx.preformatted:
+            return '\n'.join([escape(line[self.MARK:])
+                              for line in self.lines])
         return tags.BR.join([
-            cgi.escape(line, quote=True).replace(' ', tags.SPACE)
+            escape(line[self.MARK:]).replace(' ', tags.SPACE)
             for line in self.lines])
 
 
 class AsciiArtMarkEach(AsciiArtBase):
+    __slots__ = ()
+    MARK = 2
+
     def __init__(self, lines, inline):
-        AsciiArtBase.__init__(self, [ln[2:] for ln in lines], inline)
+        AsciiArtBase.__init__(self, lines, inline)
 
 
 class OneLineBlock(Block):
+    __slots__ = ('text',)
+    FIELDS = ('text',)
+
     def __init__(self, text, inline):
         Block.__init__(self, inline)
         self.text = text
 
     def truncate_to(self, limit):
-        return limit - len(self.text)
+        return max(limit - len(self.text), 0)
 
 
 class Heading(OneLineBlock):
+    __slots__ = ('level',)
+    FIELDS = ('text', 'level')
+
     def __init__(self, lines, inline):
         line = lines[0]
         space = line.find(' ')
@@ -238,8 +298,8 @@ class Heading(OneLineBlock):
 
 class LinePattern(object):
     def __init__(self, pattern_begin, pattern_end, ctor, start_exc, end_exc):
-        self.begin = re.compile(pattern_begin)
-        self.end = re.compile(pattern_end)
+        self.begin = lazyre.compile(pattern_begin)
+        self.end = lazyre.compile(pattern_end)
         self.ctor = ctor
         self.start_excluded = start_exc
         self.end_excluded = end_exc
@@ -247,7 +307,11 @@ class LinePattern(object):
 
 class ParaForge(object):
     def __init__(self, render_table, inline):
+        self.render_table = render_table
         self.inline = inline
+        # (offset, message) of malformed blocks while validating, see
+        # DocumentForge.validate
+        self.problems = None
 
         table_cap_ctor = lambda lines, inline: TableWithCaption(
             lines, render_table, inline)
@@ -256,7 +320,7 @@ class ParaForge(object):
         self.line_patterns = (
             LinePattern('[*][ ]', '(?![*][ ])', Bullets, False, False),
             LinePattern('[#][ ]', '(?![#][ ])', SortedList, False, False),
-            LinePattern(r'^\|\|', r'(?![\|])', table_cap_ctor, False, False),
+            LinePattern(r'\|\|', r'(?![\|])', table_cap_ctor, False, False),
             LinePattern(r'[\|]', r'(?![\|])', table_ctor, False, False),
             LinePattern(r'[=]+[ ]', '', Heading, False, False),
             LinePattern('(: |:$)', '(?!(: |:$))', AsciiArtMarkEach, False,
@@ -264,59 +328,70 @@ class ParaForge(object):
             LinePattern(':::', ':::', AsciiArtBase, True, True),
             # CodeBlock is parsed when partition
         )
-
-    def _get_para(self, pattern, lines, begin, offset):
+        # alternatives are tried in order, so the first pattern in
+        # line_patterns that matches a line is the group that matches
+        alternatives = '|'.join([
+            '(?P<p%d>%s)' % (i, p.begin.pattern)
+            for i, p in enumerate(self.line_patterns)])
+        self.begin_pattern = lazyre.compile(alternatives)
+        # finds the next line beginning a block without looking at each line
+        self.line_begin_pattern = lazyre.compile(
+            '^(?:%s)' % alternatives, lazyre.M)
+        self.patterns_by_group = dict([
+            ('p%d' % i, p) for i, p in enumerate(self.line_patterns)])
+
+    def _get_para(self, pattern, doc, begin, end):
+        start = begin
+        last = line_end(doc, begin, end)
         if pattern.start_excluded:
-            offset += len(lines[begin]) + 1
-            begin += 1
-        end = begin + 1
-        offset += len(lines[begin]) + 1
-        while end < len(lines) and not pattern.end.match(lines[end]):
-            offset += len(lines[end]) + 1
-            end += 1
-        if pattern.end_excluded:
-            if end < len(lines):
-                offset += len(lines[end]) + 1
-            para = pattern.ctor(lines[begin: end], self.inline)
-            end += 1
+            begin = last + 1
+            if begin > end:
+                self._unclosed(pattern, start)
+                return pattern.ctor([], self.inline), begin
+            last = line_end(doc, begin, end)
+        pos = last + 1
+        while pos <= end:
+            ln_end = line_end(doc, pos, end)
+            if pattern.end.match(doc, pos, ln_end):
+                if pattern.end_excluded:
+                    pos = ln_end + 1
+                break
+            last = ln_end
+            pos = ln_end + 1
         else:
-            para = pattern.ctor(lines[begin: end], self.inline)
-        return end, para, offset
-
-    def _normal_text_from(self, document, begin, offset):
-        begin_pattern = self._match_pattern_begin(document[begin])
-        if begin_pattern is not None:
-            return begin_pattern, begin, None, offset
-        offset += len(document[begin]) + 1
-        end = begin + 1
-        while end < len(document):
-            begin_pattern = self._match_pattern_begin(document[end])
-            if begin_pattern is not None:
-                return begin_pattern, end, Paragraph.make(
-                    document[begin: end], self.inline), offset
-            offset += len(document[end]) + 1
-                                        # +1 possible '\n' at the end of line
-            end += 1
-        return None, end, Paragraph.make(
-            document[begin: end], self.inline), offset
-
-    def _match_pattern_begin(self, line):
-        for pattern in self.line_patterns:
-            if pattern.begin.match(line):
-                return pattern
-        return None
-
-    def find_paras(self, text):
-        document = text.split('\n')
-        text_len = len(text)
-        cursor = 0
-        offset = 0
-        while cursor < len(document):
-            pattern, cursor, section, offset = self._normal_text_from(
-                document, cursor, offset)
-            if section is not None:
-                yield section, min(offset, text_len)
-            if cursor < len(document):
-                cursor, section, offset = self._get_para(pattern, document,
-                                                         cursor, offset)
-                yield section, min(offset, text_len)
+            self._unclosed(pattern, start)
+        return pattern.ctor(lines_of(doc, begin, last), self.inline), pos
+
+    def _unclosed(self, pattern, start):
+        # only blocks with a closing line, like :::, can be left open
+        if self.problems is not None and pattern.end_excluded:
+            self.problems.append((start, 'unclosed %s block' %
+                                  pattern.begin.pattern))
+
+    def _next_block(self, doc, pos, end):
+        ln_end = line_end(doc, pos, end)
+        m = self.begin_pattern.match(doc, pos, ln_end)
+        if m is None and ln_end < end:
+            m = self.line_begin_pattern.search(doc, ln_end + 1, end)
+        return m
+
+    def find_paras(self, doc, start=0, end=None):
+        # scans doc[start: end] by offset, slicing only the lines of a block
+        if end is None:
+            end = len(doc)
+        pos = start
+        while pos <= end:
+            m = self._next_block(doc, pos, end)
+            if m is None:
+                para = Paragraph.make(lines_of(doc, pos, end), self.inline)
+                if para is not None:
+                    yield para, end
+                return
+            if m.start() > pos:
+                para = Paragraph.make(lines_of(doc, pos, m.start() - 1),
+                                      self.inline)
+                if para is not None:
+                    yield para, m.start()
+            para, pos = self._get_para(
+                self.patterns_by_group[m.lastgroup], doc, m.start(), end)
+            yield para, min(pos, end)
@@ -0,0 +1,181 @@
+import os
+import time
+import urlparse
+import argparse
+import mimetypes
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+
+from document import render_footnotes
+import render
+import toc
+
+IMAGE_DIRECTORY = 'images'
+POLL_INTERVAL = 0.5
+
+PREVIEW_SCRIPT = u'''<script>
+$('a[href^="#title-"]').each(function(i, e) {
+    var id = e.getAttribute('href').substring('#title-'.length);
+    e.setAttribute('href', '?p=' + id.replace('-', '.') + '#title-' + id);
+});
+new EventSource('/_events').onmessage = function() {
+    location.reload();
+};
+</script>
+'''
+
+
+class LRUCache(object):
+    # shared by the request threads of the server
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return None
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+def content_stamp(content_dir):
+    stamp = []
+    for root, dirs, files in os.walk(content_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            stamp.append((path, os.path.getmtime(path)))
+    return sorted(stamp)
+
+
+class Previewer(object):
+    def __init__(self, content_dir, capacity):
+        self.content_dir = content_dir
+        self.fragments = LRUCache(capacity)
+
+    def fragment(self, path, index, sindex):
+        key = (path, os.path.getmtime(path))
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            fragment = render.compile_doc(render.read_doc(path), index, sindex)
+            self.fragments.put(key, fragment)
+        return fragment
+
+    def page(self, chapter, section):
+        head = []
+        segs = []
+        footnotes = []
+        scratch = []
+
+        def wanted(index, sindex):
+            return index == chapter and section in (None, sindex)
+
+        current = None
+        for item in render.list_content(self.content_dir):
+            if item[0] == 'h1':
+                current = None
+                toc.add_h1(render.render, item[1], item[2], head,
+                           segs if wanted(item[1], None) else scratch)
+            elif item[0] == 'h2':
+                current = item[2]
+                toc.add_h2(render.render, item[1], item[2], item[3], head,
+                           segs if wanted(item[1], current) else scratch)
+            elif wanted(item[2], current):
+                fragment = self.fragment(*item[1:])
+                segs.extend(fragment.renumbered(len(footnotes)))
+                footnotes.extend(fragment.footnotes)
+        html = render.render('main.html', toc=head, body=segs,
+                             footnotes=render_footnotes(footnotes))
+        end = html.rfind('</body>')
+        if end == -1:
+            return html + PREVIEW_SCRIPT
+        return html[:end] + PREVIEW_SCRIPT + html[end:]
+
+
+def parse_page(query):
+    p = urlparse.parse_qs(query).get('p', [''])[0]
+    if not p:
+        return None, None
+    parts = p.split('.')
+    return int(parts[0]), (int(parts[1]) if len(parts) > 1 else None)
+
+
+class PreviewHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        try:
+            if url.path == '/':
+                chapter, section = parse_page(url.query)
+                self._send(200, 'text/html; charset=utf-8',
+                           self.server.previewer.page(chapter, section)
+                               .encode('utf-8'))
+            elif url.path == '/_events':
+                self._events()
+            elif url.path.startswith('/views/'):
+                self._static(render.TEMPLATE_DIRECTORY, url.path[7:])
+            elif url.path.startswith('/images/'):
+                self._static(IMAGE_DIRECTORY, url.path[8:])
+            else:
+                self.send_error(404)
+        except ValueError:
+            self.send_error(400)
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _static(self, directory, name):
+        path = os.path.join(directory, os.path.basename(name))
+        if not os.path.isfile(path):
+            return self.send_error(404)
+        with open(path, 'rb') as f:
+            self._send(200, mimetypes.guess_type(path)[0] or
+                       'application/octet-stream', f.read())
+
+    def _events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        content_dir = self.server.previewer.content_dir
+        stamp = content_stamp(content_dir)
+        while content_stamp(content_dir) == stamp:
+            time.sleep(POLL_INTERVAL)
+        self.wfile.write('data: reload\n\n')
+
+
+class PreviewServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, previewer):
+        BaseHTTPServer.HTTPServer.__init__(self, address, PreviewHandler)
+        self.previewer = previewer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='number of compiled content files to keep')
+    args = parser.parse_args()
+
+    previewer = Previewer(render.CONTENT_DIRECTORY, args.cache_size)
+    PreviewServer(('127.0.0.1', args.port), previewer).serve_forever()
+
+if __name__ == '__main__':
+    main()
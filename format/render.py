@@ -1,64 +1,602 @@
 import os
-import re
-import jinja2
+import sys
+import json
+import mmap
+import time
+import shutil
+import argparse
+import itertools
 
-from document import DocumentForge
-from inline import InlineForge
+from document import DocumentForge, Index
+import document
+from inline import InlineForge, ForgeCache
+from cache import BuildCache, JsonStore, fingerprint
+from assets import Assets, Links, precompress, prune_hashed
+from manifest import FragmentWriter
+import lazyre
+import instrument
+import search
+import images
+import tree
 import toc
 
-SECTION_PAT = re.compile(r'^(?P<index>(\d)+)\.(?P<title>(.*))$')
+SECTION_PAT = lazyre.compile(r'^(?P<index>(\d)+)\.(?P<title>(.*))$')
+CONTENT_DIRECTORY = 'content'
 TEMPLATE_DIRECTORY = 'views'
+CACHE_DIRECTORY = '.build-cache'
+TEMPLATE_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'templates')
+TREE_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'trees')
+HIGHLIGHT_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'highlight')
+IMAGE_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'images')
+OUTPUT_FILE = 'output.html'
+PAGES_DIRECTORY = 'pages'
+INDEX_PAGE = 'index.html'
+ASSET_SUFFIXES = ('.js', '.css')
+ASSET_OUTPUT_DIRECTORY = 'static'
+SEARCH_DIRECTORY = 'search'
+IMAGE_DIRECTORY = 'images'
+INLINE_CACHE_LINES = 4096
 
-_env = jinja2.Environment(extensions=[
-    'jinja2.ext.autoescape', 'jinja2.ext.loopcontrols', 'jinja2.ext.do',
-], loader=jinja2.FileSystemLoader(TEMPLATE_DIRECTORY))
+_envs = {}
+# views of the build running in this process
+template_directory = TEMPLATE_DIRECTORY
+# body rows past this many go into chunks the reader expands on demand;
+# 0 keeps every table whole
+table_chunk = 0
 
-def render(filename, **kwargs):
-    return _env.get_template(filename).render(**kwargs)
+def environment(directory=None):
+    # jinja2 is imported on first use, tools that only parse skip it
+    directory = directory or template_directory
+    if directory not in _envs:
+        import jinja2
+        if not os.path.isdir(TEMPLATE_CACHE_DIRECTORY):
+            os.makedirs(TEMPLATE_CACHE_DIRECTORY)
+        _envs[directory] = jinja2.Environment(extensions=[
+            'jinja2.ext.autoescape', 'jinja2.ext.loopcontrols',
+            'jinja2.ext.do',
+        ], loader=jinja2.FileSystemLoader(directory),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(
+                TEMPLATE_CACHE_DIRECTORY))
+    return _envs[directory]
 
-def render_table(caption, head_rows, body_rows):
-    return render('table.html', caption=caption, head_rows=head_rows,
-                  body_rows=body_rows)
+def render(filename, **kwargs):
+    return environment().get_template(filename).render(links=links, **kwargs)
 
-def render_doc(sec, doc):
-    with open(os.path.join('content', sec, doc)) as i:
-        return forge.compile_entire(u(i.read()))
+def render_table(caption, head_rows, body_rows, size):
+    # body_rows is a generator of size rows, the chunks share it and are
+    # consumed in order
+    more = ()
+    if table_chunk and size > table_chunk:
+        rows = iter(body_rows)
+        body_rows = itertools.islice(rows, table_chunk)
+        more = (itertools.islice(rows, table_chunk)
+                for _ in xrange(table_chunk, size, table_chunk))
+    with instrument.measure('stage', 'render_table'):
+        return render('table.html', caption=caption, head_rows=head_rows,
+                      body_rows=body_rows, more=more)
 
-forge = DocumentForge(render_table, InlineForge())
+forge = DocumentForge(render_table,
+                      InlineForge(cache=ForgeCache(INLINE_CACHE_LINES)))
+links = Links(TEMPLATE_DIRECTORY)
 
 def u(x):
     return unicode(x, 'utf-8')
 
-head = []
-segs = []
+def read_doc(path):
+    with open(path) as i:
+        return u(i.read())
 
-for sec in sorted(os.listdir('content')):
-    if os.path.isfile(os.path.join('content', sec)):
-        continue
-    match = SECTION_PAT.match(sec).groupdict()
-    index = int(match['index'])
-    title = u(match['title'])
-    toc.add_h1(render, index, title, head, segs)
+def map_doc(path):
+    # a read-only utf-8 buffer that forge.partition works on in place
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-    docs = []
-    for doc in os.listdir(os.path.join('content', sec)):
-        if not doc or '.' == doc[0]:
-            continue
-        if doc.startswith('0.-'):
-            segs.extend(render_doc(sec, doc))
+def list_content(content_dir=CONTENT_DIRECTORY):
+    plan = []
+    for sec in sorted(os.listdir(content_dir)):
+        if os.path.isfile(os.path.join(content_dir, sec)):
             continue
+        match = SECTION_PAT.match(sec).groupdict()
+        index = int(match['index'])
+        title = u(match['title'])
+        plan.append(('h1', index, title))
+
+        docs = []
+        for doc in os.listdir(os.path.join(content_dir, sec)):
+            if not doc or '.' == doc[0]:
+                continue
+            path = os.path.join(content_dir, sec, doc)
+            if doc.startswith('0.-'):
+                plan.append(('doc', path, index, 0))
+                continue
+
+            match = SECTION_PAT.match(doc).groupdict()
+            sindex = int(match['index'])
+            title = os.path.splitext(u(match['title']))[0]
+            docs.append((sindex, title, path))
+
+        for sindex, title, path in sorted(docs, key=lambda x: x[0]):
+            plan.append(('h2', index, sindex, title))
+            plan.append(('doc', path, index, sindex))
+    return plan
+
+def compile_doc(text, index, sindex):
+    return forge.compile_fragment(text, Index(index, sindex))
+
+def excerpt(path, limit, index, sindex):
+    # html of about limit characters and whether it holds the whole file;
+    # blocks past the limit are neither decoded nor parsed
+    return forge.compile_partial(map_doc(path), limit, Index(index, sindex))
+
+def _compile_job(job):
+    cache, path, index, sindex, tokenize = job
+    text = read_doc(path)
+    with instrument.measure('file', path, len(text), rss=True):
+        fragment = _compile_or_load(cache, text, index, sindex)
+    if tokenize:
+        with instrument.measure('stage', 'search_terms', len(text)):
+            fragment.terms = search.terms(text)
+    return fragment
+
+def _compile_or_load(cache, text, index, sindex):
+    if cache is None:
+        return compile_doc(text, index, sindex)
+    key = cache.key(text, Index(index, sindex))
+    fragment = cache.load(key)
+    if fragment is None:
+        fragment = compile_doc(text, index, sindex)
+        cache.store(key, fragment)
+    return fragment
+
+def compile_docs(plan, cache, pool=None, tokenize=False):
+    jobs = [(cache, item[1], item[2], item[3], tokenize)
+            for item in plan if item[0] == 'doc']
+    if pool is None:
+        return itertools.imap(_compile_job, jobs)
+    return pool.imap(_compile_job, jobs)
+
+def render_headings(plan, head):
+    headings = []
+    for item in plan:
+        if item[0] == 'h1':
+            toc.add_h1(render, item[1], item[2], head, headings)
+        elif item[0] == 'h2':
+            toc.add_h2(render, item[1], item[2], item[3], head, headings)
+    return headings
+
+def search_targets(plan, split=None):
+    # link and title of the heading each doc is filed under
+    targets = []
+    page = ''
+    for item in plan:
+        if item[0] == 'h1':
+            if split:
+                page = page_name(item, split)
+            target = [page + '#title-%d' % item[1],
+                      u'%d - %s' % (item[1], item[2])]
+        elif item[0] == 'h2':
+            if split == 'section':
+                page = page_name(item, split)
+            target = [page + '#title-%d-%d' % (item[1], item[2]),
+                      u'%d.%d - %s' % (item[1], item[2], item[3])]
+        else:
+            targets.append(target)
+    return targets
+
+def assemble(plan, headings, fragments):
+    headings = iter(headings)
+    for item in plan:
+        if item[0] == 'doc':
+            for seg in forge.add_fragment(next(fragments)):
+                yield seg
+        else:
+            yield next(headings)
+
+def render_footnotes(footnotes):
+    # lazy, so footnotes added while the body streams are included
+    for footnote in document.render_footnotes(footnotes):
+        yield footnote
+
+def write_page(template, path, **kwargs):
+    stream = environment().get_template(template).stream(
+        links=links, **kwargs)
+    with open(path, 'wb') as o:
+        stream.dump(o, encoding='utf-8')
+    if isinstance(links, Assets):
+        precompress(path)
+
+def page_name(item, split):
+    if item[0] == 'h2' and split == 'section':
+        return '%d-%d.html' % (item[1], item[2])
+    return '%d.html' % item[1]
+
+def paginate(plan, split):
+    pages = []
+    for item in plan:
+        if item[0] == 'h1' or (item[0] == 'h2' and split == 'section'):
+            pages.append((page_name(item, split), []))
+        pages[-1][1].append(item)
+    return pages
+
+def assemble_page(items, headings, fragments, footnotes):
+    headings = iter(headings)
+    for item in items:
+        if item[0] == 'doc':
+            fragment = next(fragments)
+            for seg in fragment.renumbered(len(footnotes)):
+                yield seg
+            footnotes.extend(fragment.footnotes)
+        else:
+            yield next(headings)
+
+def copy_assets(directory):
+    views = os.path.join(directory, TEMPLATE_DIRECTORY)
+    if not os.path.isdir(views):
+        os.makedirs(views)
+    for name in os.listdir(template_directory):
+        if os.path.splitext(name)[1] in ASSET_SUFFIXES:
+            shutil.copy(os.path.join(template_directory, name), views)
+
+def build_single(plan, fragments, output=OUTPUT_FILE, highlighted=False,
+                 search_url=None):
+    head = []
+    with instrument.measure('stage', 'render_headings', rss=True):
+        headings = render_headings(plan, head)
+    body = assemble(plan, headings, fragments)
+    with instrument.measure('stage', 'output', rss=True):
+        write_page('main.html', output, toc=head, body=body,
+                   footnotes=render_footnotes(forge.footnotes),
+                   highlighted=highlighted, search=search_url)
+
+def build_assets(directory, prune=True):
+    # hashed, minified and precompressed copies of views/ assets
+    global links
+    links = Assets(template_directory, os.path.join(
+        directory, ASSET_OUTPUT_DIRECTORY), ASSET_OUTPUT_DIRECTORY)
+    return links.build(ASSET_SUFFIXES, prune)
+
+def build_pages(plan, fragments, split, directory, highlighted=False,
+                search_url=None):
+    # one page per chapter or section; footnotes are numbered per page
+    pages = paginate(plan, split)
+    head = []
+    page_headings = []
+    with instrument.measure('stage', 'render_headings', rss=True):
+        for name, items in pages:
+            headings = []
+            for item in items:
+                if item[0] == 'h1':
+                    toc.add_h1(render, item[1], item[2], head, headings,
+                               page=name, toc_page=INDEX_PAGE)
+                elif item[0] == 'h2':
+                    toc.add_h2(render, item[1], item[2], item[3], head,
+                               headings, page=name, toc_page=INDEX_PAGE)
+            page_headings.append(headings)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if not isinstance(links, Assets):
+        copy_assets(directory)
+    with instrument.measure('stage', 'output', rss=True):
+        write_page('main.html', os.path.join(directory, INDEX_PAGE),
+                   toc=head, body=[], footnotes=[], highlighted=highlighted,
+                   search=search_url)
+        for (name, items), headings in zip(pages, page_headings):
+            footnotes = []
+            write_page('page.html', os.path.join(directory, name),
+                       toc_page=INDEX_PAGE, highlighted=highlighted,
+                       search=search_url,
+                       footnotes=render_footnotes(
+                           footnotes), body=assemble_page(
+                           items, headings, fragments, footnotes))
+
+def fragment_id(item):
+    if item[0] == 'h2':
+        return '%d-%d' % (item[1], item[2])
+    return '%d' % item[1]
+
+def write_fragment(writer, fragment_id, parts, footnotes):
+    writer.write(fragment_id, u''.join(parts))
+    if footnotes:
+        writer.write(fragment_id + '-footnotes', u''.join(footnotes))
+
+def build_fragments(plan, fragments, directory):
+    # every chapter or section, its footnotes and the toc as its own hashed
+    # file; footnotes keep their per-fragment numbering, so editing one
+    # section leaves the files of the others unchanged, and their ids carry
+    # the fragment id, so fragments can share a page
+    writer = FragmentWriter(directory,
+                            precompress if isinstance(links, Assets) else None)
+    head = []
+    # [id, html parts, footnotes] of the fragment being filled; a chapter
+    # may hold several intro docs, all part of its fragment
+    current = None
+    with instrument.measure('stage', 'output', rss=True):
+        for item in plan:
+            if item[0] == 'doc':
+                segs, footnotes = next(fragments).prefixed(
+                    current[0], len(current[2]))
+                current[1].extend(segs)
+                current[2].extend(footnotes)
+                continue
+            if current is not None:
+                write_fragment(writer, *current)
+            headings = []
+            if item[0] == 'h1':
+                toc.add_h1(render, item[1], item[2], head, headings)
+            else:
+                toc.add_h2(render, item[1], item[2], item[3], head, headings)
+            current = fragment_id(item), [headings[0]], []
+        if current is not None:
+            write_fragment(writer, *current)
+        writer.write('toc', u''.join(head))
+        writer.finish()
+    changed = writer.changed()
+    sys.stderr.write('%d of %d fragments changed%s\n' % (
+        len(changed), len(writer.entries),
+        ': ' + ' '.join(changed) if changed else ''))
+
+def build_images(plan, jobs, cache_directory):
+    # sizes and resized variants of every [img] the content refers to; the
+    # table is set on the inline forge before the compile pool forks
+    names = images.references(
+        read_doc(item[1]) for item in plan if item[0] == 'doc')
+    pool = None
+    if jobs > 1 and len(names) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+    try:
+        return images.process(names, IMAGE_DIRECTORY, cache_directory, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def write_profile(recorder, path, top):
+    report = recorder.report()
+    cache = forge.para_forge.inline.cache
+    if cache is not None:
+        report['inline_cache'] = cache.report()
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    for (kind, name), s in recorder.top(top):
+        sys.stderr.write('%8.3fs %8d calls %10d in %8s KB  %s %s\n' % (
+            s.seconds, s.calls, s.input, '-' if s.rss_kb is None else
+            s.rss_kb, kind, name.encode('utf-8')
+            if isinstance(name, unicode) else name))
+    if cache is not None:
+        c = report['inline_cache']
+        sys.stderr.write('inline cache: %d hits, %d misses (%.1f%%), %.3fs '
+                         'saved\n' % (c['hits'], c['misses'],
+                                      100 * c['hit_rate'], c['seconds_saved']))
+
+def output_root(args):
+    # the directory assets and the search index are written under
+    if args.fragments:
+        return args.fragments
+    return args.output_dir if args.split else (
+        os.path.dirname(args.output) or '.')
+
+def build(args):
+    # one build; resets what an earlier build in this process left behind
+    global template_directory, table_chunk, links
+    template_directory = args.templates
+    table_chunk = args.table_chunk
+    root = output_root(args)
+    # split builds copy the views next to the pages
+    links = Links(TEMPLATE_DIRECTORY if args.split else
+                  os.path.relpath(args.templates, root))
+    forge.footnotes = []
+    forge.highlighter = forge.trees = None
+    forge.preformatted = args.preformatted
+
+    options = []
+    if args.highlight:
+        import highlight
+        forge.highlighter = highlight.Highlighter(
+            None if args.no_cache else JsonStore(HIGHLIGHT_CACHE_DIRECTORY))
+        options.append('highlight')
+    if args.preformatted:
+        options.append('preformatted')
+    if args.table_chunk:
+        options.append('table-chunk=%d' % args.table_chunk)
+
+    with instrument.measure('stage', 'list_content', rss=True):
+        plan = list_content(args.content)
+    inline = forge.para_forge.inline
+    # forged lines may hold the image sizes of an earlier build
+    if inline.cache is not None and (inline.images or args.images):
+        inline.cache.clear()
+    inline.images = None
+    if args.images:
+        with instrument.measure('stage', 'images', rss=True):
+            inline.images = build_images(
+                plan, args.jobs,
+                None if args.no_cache else IMAGE_CACHE_DIRECTORY)
+        options.append('images=' + images.digest(inline.images))
+
+    cache = None
+    if not args.no_cache:
+        cache = BuildCache(CACHE_DIRECTORY,
+                           fingerprint(template_directory, *options))
+        forge.trees = tree.ParseTreeStore(TREE_CACHE_DIRECTORY)
+
+    pool = None
+    if args.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(args.jobs)
+
+    if args.assets:
+        with instrument.measure('stage', 'assets', rss=True):
+            # batch jobs may share the directory, run_batch prunes it once
+            build_assets(root, args.batch is None)
+
+    # fragments and page bodies are generators, consumed while streaming
+    fragments = compile_docs(plan, cache, pool, args.search)
+    search_index = search_url = None
+    if args.search:
+        search_index = search.SearchIndex()
+        fragments = search_index.collect(
+            search_targets(plan, args.split), fragments)
+        search_url = SEARCH_DIRECTORY
+    if args.fragments:
+        build_fragments(plan, fragments, args.fragments)
+    elif args.split:
+        build_pages(plan, fragments, args.split, args.output_dir,
+                    args.highlight, search_url)
+    else:
+        build_single(plan, fragments, args.output, args.highlight,
+                     search_url)
+    if search_index is not None:
+        directory = os.path.join(root, SEARCH_DIRECTORY)
+        with instrument.measure('stage', 'search_index', rss=True):
+            search_index.write(directory)
+            if args.assets:
+                for name in os.listdir(directory):
+                    precompress(os.path.join(directory, name))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def _job_path(job, key, default):
+    # paths stay byte strings, as on the command line
+    value = job.get(key, default)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def batch_jobs(path, args):
+    # a json list of {"content", "templates", "output", "split"} objects;
+    # missing keys and the other options come from the command line
+    with open(path) as f:
+        jobs = json.load(f)
+    r = []
+    for job in jobs:
+        a = argparse.Namespace(**vars(args))
+        a.content = _job_path(job, 'content', args.content)
+        a.templates = _job_path(job, 'templates', args.templates)
+        a.split = job.get('split', args.split)
+        if a.split:
+            a.output_dir = _job_path(job, 'output', args.output_dir)
+        else:
+            a.output = _job_path(job, 'output', args.output)
+        a.fragments = None
+        a.jobs = 1
+        r.append(a)
+    # jobs may share assets, but not pages, nor the search index each
+    # rewrites whole
+    outputs = [a.output_dir if a.split else a.output for a in r]
+    shared = set([o for o in outputs if outputs.count(o) > 1])
+    if args.search:
+        roots = [output_root(a) for a in r]
+        shared.update([o for o in roots if roots.count(o) > 1])
+    if shared:
+        sys.exit('batch jobs write to the same output: ' +
+                 ', '.join(sorted(shared)))
+    return r
+
+def _batch_job(args):
+    start = time.time()
+    build(args)
+    names = links.names.values() if isinstance(links, Assets) else []
+    return time.time() - start, names
+
+def run_batch(args):
+    jobs = batch_jobs(args.batch, args)
+    # loaded once here; forked job processes inherit them
+    for directory in set([a.templates for a in jobs]):
+        env = environment(directory)
+        for name in env.list_templates(extensions=['html']):
+            env.get_template(name)
+    lazyre.compile_all()
+    if args.highlight:
+        import highlight
+
+    pool = None
+    if args.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+    results = (itertools.imap if pool is None else pool.imap)(
+        _batch_job, jobs)
+    asset_names = {}
+    for a, (s, names) in zip(jobs, results):
+        sys.stderr.write('%8.3fs  %s -> %s\n' % (
+            s, a.content, a.output_dir if a.split else a.output))
+        asset_names.setdefault(os.path.join(
+            output_root(a), ASSET_OUTPUT_DIRECTORY), set()).update(names)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if args.assets:
+        for directory, names in asset_names.iteritems():
+            prune_hashed(directory, names)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--content', default=CONTENT_DIRECTORY,
+                        help='content tree to render')
+    parser.add_argument('--templates', default=TEMPLATE_DIRECTORY,
+                        help='directory of templates, scripts and styles')
+    parser.add_argument('-o', '--output', default=OUTPUT_FILE,
+                        help='page written without --split')
+    parser.add_argument('--batch', metavar='JOBS',
+                        help='render every job of a JSON list in one '
+                             'process, -j of them at a time')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='recompile every content file')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes compiling content files, '
+                             'or rendering jobs with --batch')
+    parser.add_argument('--split', choices=('chapter', 'section'),
+                        help='write one page per chapter or section '
+                             'instead of --output')
+    parser.add_argument('--output-dir', default=PAGES_DIRECTORY,
+                        help='directory of the pages written by --split')
+    parser.add_argument('--fragments', metavar='DIR',
+                        help='write each chapter and section as a hashed '
+                        'fragment, with DIR/manifest.json listing them')
+    parser.add_argument('--highlight', action='store_true',
+                        help='highlight code blocks at build time instead '
+                             'of loading run_prettify.js')
+    parser.add_argument('--preformatted', action='store_true',
+                        help='keep the whitespace of code blocks and ascii '
+                             'art instead of encoding it as &nbsp; and <br>')
+    parser.add_argument('--table-chunk', type=int, default=0, metavar='ROWS',
+                        help='render only the first ROWS body rows of a '
+                             'table, the rest in chunks expanded on demand')
+    parser.add_argument('--images', action='store_true',
+                        help='give [img] its size, lazy loading and, with '
+                             'PIL, resized variants')
+    parser.add_argument('--assets', action='store_true',
+                        help='minify, fingerprint and precompress assets, '
+                             'inline critical css and precompress pages')
+    parser.add_argument('--search', action='store_true',
+                        help='write a sharded full text index and a '
+                             'search box')
+    parser.add_argument('--profile', metavar='REPORT',
+                        help='write per stage, block and file timings as '
+                             'JSON; compiles every file, in this process')
+    parser.add_argument('--profile-top', type=int, default=20,
+                        help='number of slowest entries printed')
+    args = parser.parse_args()
+
+    recorder = None
+    if args.profile:
+        recorder = instrument.enable()
+        # cached files would be loaded, leaving no block stats
+        args.jobs = 1
+        args.no_cache = True
 
-        match = SECTION_PAT.match(doc).groupdict()
-        sindex = int(match['index'])
-        title = os.path.splitext(u(match['title']))[0]
-        docs.append((sindex, title, doc))
+    if args.batch:
+        run_batch(args)
+    else:
+        build(args)
 
-    for sindex, title, doc in sorted(docs, key=lambda x: x[0]):
-        forge.set_section(index, sindex, title)
-        toc.add_h2(render, index, sindex, title, head, segs)
-        segs.extend(render_doc(sec, doc))
+    if recorder is not None:
+        write_profile(recorder, args.profile, args.profile_top)
 
-output = render('main.html', toc=head, body=segs,
-                footnotes=forge.render_footnotes())
-with open('output.html', 'w') as o:
-    o.write(output.encode('utf-8'))
+if __name__ == '__main__':
+    main()
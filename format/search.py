@@ -0,0 +1,75 @@
+import os
+import json
+import shutil
+import itertools
+
+import lazyre
+
+# shards group cjk terms by the code point of their first character, and
+# identifiers by their first letter, so every term sharing a prefix lives in
+# one file
+SHARD_SHIFT = 6
+ID_SHARD_PREFIX = 'id-'
+INDEX_FILE = 'index.json'
+
+TOKEN_PAT = lazyre.compile(
+    u'(?P<cjk>[\u3400-\u9fff\uf900-\ufaff]+)|(?P<id>[A-Za-z_][A-Za-z0-9_]*)')
+
+
+def terms(text):
+    # cjk runs give overlapping bigrams, a lone character stands for itself;
+    # identifiers are lowercased whole, like unique_ptr
+    r = set()
+    for m in TOKEN_PAT.finditer(text):
+        token = m.group()
+        if m.lastgroup == 'id':
+            r.add(token.lower())
+        elif len(token) == 1:
+            r.add(token)
+        else:
+            r.update(token[i: i + 2] for i in range(len(token) - 1))
+    return r
+
+
+def shard(term):
+    if term[0] < u'\x80':
+        return ID_SHARD_PREFIX + term[0]
+    return '%x' % (ord(term[0]) >> SHARD_SHIFT)
+
+
+class SearchIndex(object):
+    def __init__(self):
+        self.docs = []
+        self.postings = {}
+
+    def add(self, href, title, doc_terms):
+        doc = len(self.docs)
+        self.docs.append([href, title])
+        for term in doc_terms:
+            self.postings.setdefault(term, []).append(doc)
+
+    def collect(self, targets, fragments):
+        # indexes each fragment as it streams by, under its heading
+        for (href, title), fragment in itertools.izip(
+                targets, fragments):
+            self.add(href, title, fragment.terms)
+            yield fragment
+
+    def write(self, directory):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        shards = {}
+        for term, docs in self.postings.iteritems():
+            shards.setdefault(shard(term), {})[term] = docs
+        for name, postings in shards.iteritems():
+            _dump(os.path.join(directory, name + '.json'), postings)
+        _dump(os.path.join(directory, INDEX_FILE),
+              {'shift': SHARD_SHIFT, 'docs': self.docs})
+        return len(shards)
+
+
+def _dump(path, value):
+    with open(path, 'wb') as f:
+        f.write(json.dumps(value, ensure_ascii=False, sort_keys=True,
+                           separators=(',', ':')).encode('utf-8'))
@@ -4,6 +4,7 @@ AND = '&amp;'
 SPACE = '&nbsp;'
 SQUOT = '&#39;'
 DQUOT = '&#34;'
+QUOT = '&quot;'
 LT = '&lt;'
 GT = '&gt;'
 
@@ -25,6 +26,9 @@ ITALIC = '''<i>%s</i>'''
 STROKE = '''<del>%s</del>'''
 ANCHOR = '''<a href='#%s' class='anchor'>%s</a>'''
 MONOSPACE = '''<code class='codei'>%s</code>'''
+LINK = '''<a href='%s'>%s</a>'''
+PAGE = '''<a href='%s' class='page'>%s</a>'''
+USER = '''<a href='https://github.com/%s' class='user'>@%s</a>'''
 
 HEADING = u'''<h{lvl} id='{anchor}' class='h{lvl} hx'>{text}</h{lvl}>'''
 
@@ -32,6 +36,13 @@ CODE_BLOCK_CAPTION = (u'''<div class='code-snippet'>代码清单 '''
                       '''{chapter}-{section}-{index}</div><hr>''')
 CODE_BLOCK_BEGIN = ('''<div class='codeb'>'''
                     '''<code class='prettyprint lang-%s'>''')
+CODE_BLOCK_BEGIN_HIGHLIGHTED = ('''<div class='codeb'>'''
+                               '''<code class='lang-%s'>''')
+# the preformatted layout keeps spaces and newlines, styled by .codeb.pre
+CODE_BLOCK_BEGIN_PRE = ('''<div class='codeb pre'>'''
+                        '''<code class='prettyprint lang-%s'>''')
+CODE_BLOCK_BEGIN_HIGHLIGHTED_PRE = ('''<div class='codeb pre'>'''
+                                    '''<code class='lang-%s'>''')
 CODE_BLOCK_BEGIN_MONOCHR = '''<div class='codeb'><code>'''
 CODE_BLOCK_END = '</code></div>'
 
@@ -42,5 +53,17 @@ FOOTNOTE_ANCHOR = ('''<sup class='fn-anchor' id='fn-anchor-{index}'>'''
                    '''<a href='#fn-{index}'>{index}</a></sup>''')
 FOOTNOTE = (u'''<div class='fn' id='fn-{index}'>'''
             '''<a href='#fn-anchor-{index}'>^</a> {index}. {content}</div>''')
+# ids made unique by a prefix, for fragments that may share a page
+FOOTNOTE_ANCHOR_PREFIXED = (
+    '''<sup class='fn-anchor' id='fn-anchor-{prefix}-{index}'>'''
+    '''<a href='#fn-{prefix}-{index}'>{index}</a></sup>''')
+FOOTNOTE_PREFIXED = (
+    u'''<div class='fn' id='fn-{prefix}-{index}'>'''
+    '''<a href='#fn-anchor-{prefix}-{index}'>^</a> {index}. {content}</div>''')
 
 IMAGE = '''<img src='../images/%s'>'''
+IMAGE_SIZED = ('''<img src='../images/{uri}' width='{width}' '''
+               '''height='{height}' loading='lazy'{srcset}>''')
+IMAGE_SRCSET = (''' srcset='{candidates}' '''
+                "sizes='(max-width: {width}px) 100vw, {width}px'")
+IMAGE_CANDIDATE = '''../images/{uri} {width}w'''
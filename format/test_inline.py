@@ -0,0 +1,165 @@
+# encoding=utf-8
+
+import time
+import unittest
+
+from inline import InlineForge, EXTENSIONS
+
+# tokens per line of the timing tests, and the growth allowed when the
+# line is four times longer; linear is 4, quadratic 16
+TOKENS = 16 * 1024
+SECONDS = 2.0
+MAX_GROWTH = 8
+
+# output of the regex chain the tokenizer replaced, on constructs both
+# handle alike; mismatched nesting, which the chain turned into crossed
+# tags, is left out
+GOLDEN = [
+    (u'plain text', u'plain text', []),
+    (u'a < b && c > "d"', u'a &lt; b &amp;&amp; c &gt; &quot;d&quot;', []),
+    (u'**bold** text', u'<b>bold</b> text', []),
+    (u'a ***b** c', u'a *<b>b</b> c', []),
+    (u'`std::move(x)` is `T&&`',
+     u"<code class='codei'>std::move(x)</code> is "
+     u"<code class='codei'>T&amp;&amp;</code>", []),
+    (u'\\**x**', u'**x**', []),
+    (u'**x\\**', u'**x**', []),
+    (u'**a|**', u'**a|**', []),
+    (u'** a**', u'** a**', []),
+    (u'**a*b**', u'**a*b**', []),
+    (u'****', u'****', []),
+    (u'``', u'``', []),
+    (u'`a\\`b`', u"<code class='codei'>a`b</code>", []),
+    (u'[img a.png]', u"<img src='../images/a.png'>", []),
+    (u'[img a\\ b] [img x\\.png]',
+     u"[img a b] <img src='../images/x.png'>", []),
+    (u'^[[a]] ^[[b]]',
+     u"<sup class='fn-anchor' id='fn-anchor-0'><a href='#fn-0'>0</a></sup>",
+     [u'a]] ^[[b']),
+    (u'^[[]]',
+     u"<sup class='fn-anchor' id='fn-anchor-0'><a href='#fn-0'>0</a></sup>",
+     [u'']),
+    (u'a\\', u'a\\', []),
+    (u'中文 **加粗** `int`',
+     u"中文 <b>加粗</b> <code class='codei'>int</code>", []),
+    (u'vector<vector<int>> v;', u'vector&lt;vector&lt;int&gt;&gt; v;', []),
+]
+
+# (extension, text, html), forged with only that extension enabled; as
+# the patterns the old chain defined for them
+EXTENSION_GOLDEN = [
+    ('italic', u'an /italic/ word',
+     u'an <i>italic</i> word'),
+    ('italic', u'a/b/c',
+     u'a/b/c'),
+    ('italic', u'/x/y',
+     u'/x/y'),
+    ('italic', u'/ x/',
+     u'/ x/'),
+    ('italic', u'/**b**/ ',
+     u'<i><b>b</b></i> '),
+    ('stroke', u'~gone~ here',
+     u'<del>gone</del> here'),
+    ('stroke', u'~ x~',
+     u'~ x~'),
+    ('stroke', u'a ~b\\~~',
+     u'a <del>b~</del>'),
+    ('anchor', u'see #sec#',
+     u"see <a href='#sec' class='anchor'>sec</a>"),
+    ('anchor', u'##',
+     u'##'),
+    ('anchor', u'#a **b**#',
+     u"<a href='#a **b**' class='anchor'>a <b>b</b></a>"),
+    ('link', u'[link http://a.com]',
+     u"<a href='http://a.com'>http://a.com</a>"),
+    ('link', u'[link http://a.com|**the** site]',
+     u"<a href='http://a.com'><b>the</b> site</a>"),
+    ('link', u'[link a b]',
+     u'[link a b]'),
+    ('link', u'[link a|b',
+     u'[link a|b'),
+    ('link', u'[link a|x] and [link b]',
+     u"<a href='a'>x</a> and <a href='b'>b</a>"),
+    ('page', u'[p 1-2.html|chapter]',
+     u"<a href='1-2.html' class='page'>chapter</a>"),
+    ('page', u'[p x]',
+     u"<a href='x' class='page'>x</a>"),
+    ('page', u'[p |x]',
+     u'[p |x]'),
+    ('user', u'by @neuront.',
+     u"by <a href='https://github.com/neuront' class='user'>@neuront</a>."),
+    ('user', u'@a.b',
+     u'@a.b'),
+    ('user', u'mail a@b',
+     u"mail a<a href='https://github.com/b' class='user'>@b</a>"),
+    ('user', u'@1x',
+     u'@1x'),
+]
+
+# unbalanced openers, each a token the forge has to give up on
+PATHOLOGICAL = [u'**a', u'`a ', u'^[[', u'[img ', u'**`^[[\\', u'*', u'\\*']
+# the same, forged with every extension enabled
+PATHOLOGICAL_EXTENSIONS = [u'[link a|b', u'[link ', u'[p ', u'[p x|', u'/a',
+                           u'~a', u'#a', u'@a', u'[link [p /~#@']
+
+
+class Context(object):
+    def __init__(self):
+        self.footnotes = []
+
+    def next_footnote_index(self, footnote):
+        self.footnotes.append(footnote)
+        return len(self.footnotes) - 1
+
+
+def _seconds(forge, line):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        forge.forge(line, Context())
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class InlineForgeTest(unittest.TestCase):
+    def test_golden(self):
+        forge = InlineForge()
+        for text, html, footnotes in GOLDEN:
+            ctx = Context()
+            self.assertEqual(html, forge.forge(text, ctx), text)
+            self.assertEqual(footnotes, ctx.footnotes, text)
+
+    def test_extension_golden(self):
+        for name, text, html in EXTENSION_GOLDEN:
+            forge = InlineForge(extensions=(name,))
+            self.assertEqual(html, forge.forge(text, Context()), text)
+
+    def _check_time(self, forge, tokens):
+        for token in tokens:
+            seconds = _seconds(forge, token * TOKENS)
+            self.assertLess(seconds, SECONDS, repr(token))
+
+    def _check_linear(self, forge, tokens):
+        for token in tokens:
+            short = _seconds(forge, token * (TOKENS // 4))
+            long = _seconds(forge, token * TOKENS)
+            # below a millisecond the timer says little about growth
+            self.assertLess(long, max(short, 0.001) * MAX_GROWTH, repr(token))
+
+    def test_pathological_time(self):
+        self._check_time(InlineForge(), PATHOLOGICAL)
+
+    def test_pathological_linear(self):
+        self._check_linear(InlineForge(), PATHOLOGICAL)
+
+    def test_pathological_extensions_time(self):
+        self._check_time(InlineForge(extensions=sorted(EXTENSIONS)),
+                         PATHOLOGICAL_EXTENSIONS)
+
+    def test_pathological_extensions_linear(self):
+        self._check_linear(InlineForge(extensions=sorted(EXTENSIONS)),
+                           PATHOLOGICAL_EXTENSIONS)
+
+if __name__ == '__main__':
+    unittest.main()
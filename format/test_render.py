@@ -0,0 +1,57 @@
+# encoding=utf-8
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import render
+
+
+def _write(path, text):
+    with open(path, 'wb') as f:
+        f.write(text.encode('utf-8'))
+
+
+class BuildFragmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.content = os.path.join(self.root, 'content')
+        chapter = os.path.join(self.content, u'1.章'.encode('utf-8'))
+        os.makedirs(chapter)
+        _write(os.path.join(chapter, '0.-a.txt'), u'first intro ^[[one]]')
+        _write(os.path.join(chapter, '0.-b.txt'), u'second intro ^[[two]]')
+        _write(os.path.join(chapter, u'1.节.txt'.encode('utf-8')),
+               u'section ^[[three]]')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _fragments(self, directory):
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            entries = json.load(f)['fragments']
+        r = {}
+        for e in entries:
+            with open(os.path.join(directory, e['file'])) as f:
+                r[e['id']] = f.read().decode('utf-8')
+        return r
+
+    def test_intro_docs_share_chapter_fragment(self):
+        plan = render.list_content(self.content)
+        directory = os.path.join(self.root, 'fragments')
+        render.build_fragments(plan, render.compile_docs(plan, None),
+                               directory)
+        fragments = self._fragments(directory)
+        self.assertEqual(['1', '1-1', '1-1-footnotes', '1-footnotes', 'toc'],
+                         sorted(fragments))
+        self.assertIn('first intro', fragments['1'])
+        self.assertIn('second intro', fragments['1'])
+        # footnotes of the intro docs are numbered on from each other
+        self.assertIn("id='fn-anchor-1-0'", fragments['1'])
+        self.assertIn("id='fn-anchor-1-1'", fragments['1'])
+        self.assertEqual(2, fragments['1-footnotes'].count("class='fn'"))
+        self.assertIn("id='fn-1-1-0'", fragments['1-1-footnotes'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import hashlib
+import marshal
+
+import inline
+import lazyre
+import paragraph
+import document
+import instrument
+from cache import JsonStore
+
+# a tree is a list of [end, kind, field...] records, one per block, where
+# end is the offset partition yielded and the fields follow Block.FIELDS
+KINDS = dict([(cls.__name__, cls) for cls in (
+    paragraph.Paragraph, paragraph.Bullets, paragraph.SortedList,
+    paragraph.Table, paragraph.TableWithCaption, paragraph.AsciiArtBase,
+    paragraph.AsciiArtMarkEach, paragraph.Heading, document.CodeBlock,
+)])
+
+
+def _parser_version():
+    h = hashlib.sha1(str(marshal.version))
+    # inline.py and lazyre.py hold the patterns tables split rows with
+    for path in (lazyre.__file__, inline.__file__, paragraph.__file__,
+                 document.__file__, __file__):
+        with open(os.path.splitext(path)[0] + '.py', 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def dump(blocks):
+    return [[end, type(block).__name__] +
+            [getattr(block, name) for name in block.FIELDS]
+            for block, end in blocks]
+
+
+def load(tree, forge):
+    para_forge = forge.para_forge
+    blocks = []
+    for record in tree:
+        cls = KINDS[record[1]]
+        block = cls.__new__(cls)
+        block.inline = para_forge.inline
+        for name, value in zip(cls.FIELDS, record[2:]):
+            setattr(block, name, value)
+        if isinstance(block, paragraph.Table):
+            block.render_table = para_forge.render_table
+        elif isinstance(block, document.CodeBlock):
+            block.set_highlighter(forge.highlighter)
+        blocks.append((block, record[0]))
+    return blocks
+
+
+class ParseTreeStore(JsonStore):
+    # marshal, since json decoding alone is slower than reparsing
+    SUFFIX = '.tree'
+
+    def __init__(self, directory):
+        JsonStore.__init__(self, directory)
+        self.version = _parser_version()
+
+    def _read(self, f):
+        return marshal.load(f)
+
+    def _write(self, value, f):
+        marshal.dump(value, f)
+
+    def key(self, text):
+        h = hashlib.sha1(self.version)
+        h.update(text.encode('utf-8'))
+        return h.hexdigest()
+
+    def parse(self, forge, text):
+        key = self.key(text)
+        with instrument.measure('stage', 'tree_load', len(text)):
+            tree = self.load(key)
+            if tree is not None:
+                return load(tree, forge)
+        blocks = list(forge.partition(text))
+        self.store(key, dump(blocks))
+        return blocks
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import argparse
+
+import render
+
+
+def documents(content_dir, problems):
+    # the files list_content would read, with the names it cannot parse
+    # reported instead of raised
+    for sec in sorted(os.listdir(content_dir)):
+        sec_path = os.path.join(content_dir, sec)
+        if os.path.isfile(sec_path):
+            continue
+        if render.SECTION_PAT.match(sec) is None:
+            problems.append((sec_path, None, 'malformed chapter name'))
+        for doc in sorted(os.listdir(sec_path)):
+            if not doc or '.' == doc[0]:
+                continue
+            path = os.path.join(sec_path, doc)
+            if not doc.startswith('0.-') and (
+                    render.SECTION_PAT.match(doc) is None):
+                problems.append((path, None, 'malformed section name'))
+            elif not os.path.isfile(path):
+                problems.append((path, None, 'not a file'))
+            else:
+                yield path
+
+
+def validate(content_dir):
+    # (path, line or None, message) of every problem found
+    problems = []
+    for path in documents(content_dir, problems):
+        try:
+            text = render.read_doc(path)
+        except UnicodeDecodeError as e:
+            problems.append((path, None, 'not utf-8: %s' % e))
+            continue
+        for offset, message in render.forge.validate(text):
+            problems.append((path, text.count('\n', 0, offset) + 1, message))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='check that the content parses, without rendering it')
+    parser.add_argument('--content', default=render.CONTENT_DIRECTORY)
+    args = parser.parse_args()
+
+    start = time.time()
+    problems = validate(args.content)
+    for path, line, message in problems:
+        if line is None:
+            sys.stdout.write('%s: %s\n' % (path, message))
+        else:
+            sys.stdout.write('%s:%d: %s\n' % (path, line, message))
+    sys.stderr.write('%d problems, %.3fs\n' % (len(problems),
+                                               time.time() - start))
+    if problems:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import os
+import sys
+import hashlib
+import argparse
+import subprocess
+import multiprocessing
+from distutils.spawn import find_executable
+
+from document import CodeBlock
+from cache import JsonStore
+import lazyre
+import render
+
+VERIFY_CACHE_DIRECTORY = os.path.join(render.CACHE_DIRECTORY, 'verify')
+COMPILERS = ('g++', 'clang++')
+DEFAULT_FLAGS = '-std=c++11 -fsyntax-only'
+
+# only listings with includes and a main function are whole programs, the
+# rest are excerpts that leave out declarations
+INCLUDE_PAT = lazyre.compile(r'^\s*#\s*include\b', lazyre.M)
+MAIN_PAT = lazyre.compile(r'\bmain\s*\(')
+
+
+class Listing(object):
+    __slots__ = ('label', 'path', 'line', 'source')
+
+    def __init__(self, label, path, line, source):
+        self.label = label
+        self.path = path
+        self.line = line
+        self.source = source
+
+    def complete(self):
+        return (INCLUDE_PAT.search(self.source) is not None and
+                MAIN_PAT.search(self.source) is not None)
+
+
+def listings(plan):
+    # numbered blocks are labelled chapter-section-index as their caption,
+    # counting the way CodeBlock.head does; the rest only by file and line.
+    # Forged blocks hold inline markup rather than plain source
+    for item in plan:
+        if item[0] != 'doc':
+            continue
+        text = render.read_doc(item[1])
+        index = 0
+        for block, end in render.forge.partition(text):
+            if not isinstance(block, CodeBlock):
+                continue
+            label = None
+            if block.numbered():
+                label = '%d-%d-%d' % (item[2], item[3], index)
+                index += 1
+            if block.lang == 'cpp' and not block.forged:
+                line = text.count('\n', 0, end) - len(block.lines) - 1
+                yield Listing(label, item[1], line,
+                              u'\n'.join(block.lines) + u'\n')
+
+
+def compiler_version(compiler):
+    return subprocess.check_output([compiler, '--version'])
+
+
+def cache_key(version, flags, source):
+    h = hashlib.sha1(version)
+    h.update(flags + '\0')
+    h.update(source.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _compile_job(job):
+    compiler, flags, source = job
+    p = subprocess.Popen([compiler, '-x', 'c++'] + flags.split() + ['-'],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    output = p.communicate(source.encode('utf-8'))[0]
+    return {'ok': p.returncode == 0,
+            'output': output.decode('utf-8', 'replace')}
+
+
+def verify(plan, compiler, flags, cache=None, pool=None):
+    # (listing, result) of every complete listing, only compiling those
+    # the cache has no result for
+    version = compiler_version(compiler)
+    complete = [l for l in listings(plan) if l.complete()]
+    results = [None] * len(complete)
+    keys = [cache_key(version, flags, l.source) for l in complete]
+    pending = []
+    for i, key in enumerate(keys):
+        if cache is not None:
+            results[i] = cache.load(key)
+        if results[i] is None:
+            pending.append(i)
+    jobs = [(compiler, flags, complete[i].source) for i in pending]
+    compiled = (pool.imap if pool is not None else map)(_compile_job, jobs)
+    for i, result in zip(pending, compiled):
+        results[i] = result
+        if cache is not None:
+            cache.store(keys[i], result)
+    return zip(complete, results), len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='compile check the c++ listings of the book')
+    parser.add_argument('--content', default=render.CONTENT_DIRECTORY)
+    parser.add_argument('--compiler',
+                        help='defaults to the first of %s found' %
+                        ', '.join(COMPILERS))
+    parser.add_argument('--flags', default=DEFAULT_FLAGS)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list every listing checked')
+    args = parser.parse_args()
+
+    compiler = args.compiler or next(
+        (c for c in COMPILERS if find_executable(c)), None)
+    if compiler is None:
+        sys.exit('no c++ compiler found, tried ' + ', '.join(COMPILERS))
+    cache = None if args.no_cache else JsonStore(VERIFY_CACHE_DIRECTORY)
+    pool = multiprocessing.Pool(args.jobs) if args.jobs > 1 else None
+
+    results, compiled = verify(render.list_content(args.content), compiler,
+                               args.flags, cache, pool)
+    failed = 0
+    for listing, result in results:
+        if result['ok'] and not args.verbose:
+            continue
+        sys.stdout.write('%s %s%s:%d\n' % (
+            'ok  ' if result['ok'] else 'FAIL',
+            '' if listing.label is None else listing.label + ' ',
+            listing.path, listing.line))
+        if not result['ok']:
+            failed += 1
+            sys.stdout.write(result['output'].encode('utf-8'))
+    sys.stderr.write('%d listings checked with %s, %d compiled, %d failed\n'
+                     % (len(results), compiler, compiled, failed))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
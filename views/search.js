@@ -0,0 +1,118 @@
+function bookSearch(root) {
+  var box = document.querySelector('#search input');
+  var list = document.querySelector('#search ul');
+  var index = null;
+  var shards = {};
+  var generation = 0;
+  var MAX_RESULTS = 30;
+
+  function load(name, done) {
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', root + '/' + name + '.json');
+    xhr.onload = function() {
+      done(xhr.status === 200 ? JSON.parse(xhr.responseText) : {});
+    };
+    xhr.send();
+  }
+
+  // same tokens as format/search.py, the last one also matching as a prefix
+  function tokens(text) {
+    var r = [];
+    var pat = /([\u3400-\u9fff\uf900-\ufaff]+)|([A-Za-z_][A-Za-z0-9_]*)/g;
+    var m;
+    while ((m = pat.exec(text)) !== null) {
+      if (m[2]) {
+        r.push({term: m[2].toLowerCase(), prefix: m[2].length === 1});
+      } else if (m[1].length === 1) {
+        r.push({term: m[1], prefix: true});
+      } else {
+        for (var i = 0; i + 1 < m[1].length; ++i) {
+          r.push({term: m[1].substr(i, 2), prefix: false});
+        }
+      }
+    }
+    if (r.length !== 0) {
+      r[r.length - 1].prefix = true;
+    }
+    return r;
+  }
+
+  function shardOf(term) {
+    if (term.charCodeAt(0) < 0x80) {
+      return 'id-' + term.charAt(0);
+    }
+    return (term.charCodeAt(0) >> index.shift).toString(16);
+  }
+
+  function withShards(names, done) {
+    var pending = names.filter(function(n) { return !(n in shards); });
+    if (pending.length === 0) {
+      return done();
+    }
+    var left = pending.length;
+    pending.forEach(function(name) {
+      load(name, function(postings) {
+        shards[name] = postings;
+        if (--left === 0) {
+          done();
+        }
+      });
+    });
+  }
+
+  function docsOf(token) {
+    var postings = shards[shardOf(token.term)];
+    if (!token.prefix) {
+      return postings[token.term] || [];
+    }
+    var docs = {};
+    for (var term in postings) {
+      if (term.indexOf(token.term) === 0) {
+        postings[term].forEach(function(d) { docs[d] = true; });
+      }
+    }
+    return Object.keys(docs).map(Number);
+  }
+
+  function show(docs) {
+    list.innerHTML = '';
+    docs.slice(0, MAX_RESULTS).forEach(function(d) {
+      var li = document.createElement('li');
+      var a = document.createElement('a');
+      a.href = index.docs[d][0];
+      a.textContent = index.docs[d][1];
+      li.appendChild(a);
+      list.appendChild(li);
+    });
+  }
+
+  function query() {
+    var ts = tokens(box.value);
+    var current = ++generation;
+    if (ts.length === 0) {
+      return show([]);
+    }
+    withShards(ts.map(function(t) { return shardOf(t.term); }), function() {
+      if (current !== generation) {
+        return;
+      }
+      var docs = docsOf(ts[0]);
+      ts.slice(1).forEach(function(t) {
+        var found = {};
+        docsOf(t).forEach(function(d) { found[d] = true; });
+        docs = docs.filter(function(d) { return found[d]; });
+      });
+      show(docs.sort(function(a, b) { return a - b; }));
+    });
+  }
+
+  box.addEventListener('input', function() {
+    if (index !== null) {
+      return query();
+    }
+    load('index', function(i) {
+      index = i;
+      query();
+    });
+  });
+}